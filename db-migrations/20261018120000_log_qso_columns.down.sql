@@ -0,0 +1,17 @@
+DROP INDEX IF EXISTS public.log_callsign_ts_idx;
+DROP INDEX IF EXISTS public.log_callsign_cs_qso_ts_band_uq;
+
+ALTER TABLE IF EXISTS public.log
+    DROP COLUMN IF EXISTS ts,
+    DROP COLUMN IF EXISTS qso_ts,
+    DROP COLUMN IF EXISTS cs,
+    DROP COLUMN IF EXISTS band,
+    DROP COLUMN IF EXISTS mode,
+    DROP COLUMN IF EXISTS freq;
+
+CREATE INDEX callsign_qso_ts_log_idx
+    ON public.log USING btree (callsign, (((qso ->> 'ts'::text))::double precision));
+
+CREATE UNIQUE INDEX callsign_qso_uq
+    ON public.log USING btree (callsign, ((qso ->> 'cs'::text)), ((qso ->> 'qso_ts'::text)),
+        ((qso ->> 'band'::text)));
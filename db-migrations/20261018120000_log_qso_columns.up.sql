@@ -0,0 +1,24 @@
+ALTER TABLE IF EXISTS public.log
+    ADD COLUMN ts double precision,
+    ADD COLUMN qso_ts double precision,
+    ADD COLUMN cs character varying,
+    ADD COLUMN band character varying,
+    ADD COLUMN mode character varying,
+    ADD COLUMN freq numeric;
+
+UPDATE public.log SET
+    ts = (qso->>'ts')::double precision,
+    qso_ts = (qso->>'qso_ts')::double precision,
+    cs = qso->>'cs',
+    band = qso->>'band',
+    mode = qso->>'mode',
+    freq = CASE WHEN qso->>'freq' ~ '^\d+(\.\d+)?$' THEN (qso->>'freq')::numeric END;
+
+DROP INDEX IF EXISTS public.callsign_qso_ts_log_idx;
+DROP INDEX IF EXISTS public.callsign_qso_uq;
+
+CREATE INDEX log_callsign_ts_idx
+    ON public.log USING btree (callsign, ts);
+
+CREATE UNIQUE INDEX log_callsign_cs_qso_ts_band_uq
+    ON public.log USING btree (callsign, cs, qso_ts, band);
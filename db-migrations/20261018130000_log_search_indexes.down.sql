@@ -0,0 +1,3 @@
+DROP INDEX IF EXISTS public.log_callsign_id_idx;
+DROP INDEX IF EXISTS public.log_callsign_cs_pattern_idx;
+DROP INDEX IF EXISTS public.log_callsign_qso_ts_idx;
@@ -0,0 +1,8 @@
+CREATE INDEX log_callsign_id_idx
+    ON public.log USING btree (callsign, id);
+
+CREATE INDEX log_callsign_cs_pattern_idx
+    ON public.log USING btree (callsign, cs varchar_pattern_ops);
+
+CREATE INDEX log_callsign_qso_ts_idx
+    ON public.log USING btree (callsign, qso_ts);
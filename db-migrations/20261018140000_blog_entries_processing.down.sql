@@ -0,0 +1,4 @@
+DROP INDEX IF EXISTS public.blog_entries_processing_idx;
+
+ALTER TABLE public.blog_entries
+    DROP COLUMN IF EXISTS processing;
@@ -0,0 +1,5 @@
+ALTER TABLE public.blog_entries
+    ADD COLUMN processing boolean NOT NULL DEFAULT false;
+
+CREATE INDEX blog_entries_processing_idx
+    ON public.blog_entries USING btree (id) WHERE processing;
@@ -0,0 +1,4 @@
+DROP TRIGGER IF EXISTS blog_entries_gallery_used_tr ON public.blog_entries;
+DROP FUNCTION IF EXISTS public.blog_entry_gallery_used_trf();
+ALTER TABLE IF EXISTS public.users DROP COLUMN IF EXISTS gallery_used;
+ALTER TABLE IF EXISTS public.blog_entries DROP COLUMN IF EXISTS file_size;
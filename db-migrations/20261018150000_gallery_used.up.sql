@@ -0,0 +1,39 @@
+ALTER TABLE IF EXISTS public.blog_entries
+    ADD COLUMN file_size bigint NOT NULL DEFAULT 0;
+
+ALTER TABLE IF EXISTS public.users
+    ADD COLUMN gallery_used bigint NOT NULL DEFAULT 0;
+
+CREATE OR REPLACE FUNCTION public.blog_entry_gallery_used_trf()
+    RETURNS trigger
+    LANGUAGE 'plpgsql'
+    COST 100
+    VOLATILE NOT LEAKPROOF
+AS $BODY$
+begin
+  if tg_op in ('UPDATE', 'DELETE') then
+    update users set gallery_used = gallery_used - old.file_size
+      where callsign = old.user;
+  end if;
+  if tg_op in ('INSERT', 'UPDATE') then
+    update users set gallery_used = gallery_used + new.file_size
+      where callsign = new.user;
+  end if;
+  return null;
+end;
+$BODY$;
+
+ALTER FUNCTION public.blog_entry_gallery_used_trf()
+    OWNER TO postgres;
+
+GRANT EXECUTE ON FUNCTION public.blog_entry_gallery_used_trf() TO PUBLIC;
+
+GRANT EXECUTE ON FUNCTION public.blog_entry_gallery_used_trf() TO postgres;
+
+GRANT EXECUTE ON FUNCTION public.blog_entry_gallery_used_trf() TO www;
+
+CREATE TRIGGER blog_entries_gallery_used_tr
+    AFTER INSERT OR DELETE OR UPDATE OF file_size, "user"
+    ON public.blog_entries
+    FOR EACH ROW
+    EXECUTE FUNCTION public.blog_entry_gallery_used_trf();
@@ -0,0 +1,11 @@
+DROP TRIGGER IF EXISTS blog_entries_modified_tr ON public.blog_entries;
+DROP FUNCTION IF EXISTS public.blog_modified_trf();
+DROP TRIGGER IF EXISTS blog_comments_last_comment_tr ON public.blog_comments;
+DROP FUNCTION IF EXISTS public.blog_last_comment_trf();
+DROP TRIGGER IF EXISTS blog_reactions_count_tr ON public.blog_reactions;
+DROP FUNCTION IF EXISTS public.blog_reaction_count_trf();
+DROP INDEX IF EXISTS public.blog_entries_user_id_idx;
+DROP INDEX IF EXISTS public.blog_comments_entry_id_id_idx;
+ALTER TABLE IF EXISTS public.users DROP COLUMN IF EXISTS blog_modified;
+ALTER TABLE IF EXISTS public.blog_entries DROP COLUMN IF EXISTS last_comment_id;
+ALTER TABLE IF EXISTS public.blog_entries DROP COLUMN IF EXISTS reactions;
@@ -0,0 +1,120 @@
+ALTER TABLE IF EXISTS public.blog_entries
+    ADD COLUMN reactions integer NOT NULL DEFAULT 0;
+
+ALTER TABLE IF EXISTS public.blog_entries
+    ADD COLUMN last_comment_id bigint;
+
+ALTER TABLE IF EXISTS public.users
+    ADD COLUMN blog_modified timestamp without time zone;
+
+UPDATE public.blog_entries
+    SET reactions = (select count(*) from blog_reactions
+            where entry_id = blog_entries.id),
+        last_comment_id = (select max(id) from blog_comments
+            where entry_id = blog_entries.id);
+
+UPDATE public.users
+    SET blog_modified = greatest(
+        (select max(timestamp_created) from blog_entries where "user" = users.callsign),
+        last_blog_entry_delete);
+
+CREATE INDEX blog_comments_entry_id_id_idx
+    ON public.blog_comments USING btree (entry_id, id);
+
+CREATE INDEX blog_entries_user_id_idx
+    ON public.blog_entries USING btree ("user", id);
+
+CREATE OR REPLACE FUNCTION public.blog_reaction_count_trf()
+    RETURNS trigger
+    LANGUAGE 'plpgsql'
+    COST 100
+    VOLATILE NOT LEAKPROOF
+AS $BODY$
+begin
+  if tg_op = 'INSERT' then
+    update blog_entries set reactions = reactions + 1
+      where id = new.entry_id;
+  else
+    update blog_entries set reactions = reactions - 1
+      where id = old.entry_id;
+  end if;
+  return null;
+end;
+$BODY$;
+
+ALTER FUNCTION public.blog_reaction_count_trf()
+    OWNER TO postgres;
+
+GRANT EXECUTE ON FUNCTION public.blog_reaction_count_trf() TO PUBLIC;
+
+GRANT EXECUTE ON FUNCTION public.blog_reaction_count_trf() TO postgres;
+
+GRANT EXECUTE ON FUNCTION public.blog_reaction_count_trf() TO www;
+
+CREATE TRIGGER blog_reactions_count_tr
+    AFTER INSERT OR DELETE
+    ON public.blog_reactions
+    FOR EACH ROW
+    EXECUTE FUNCTION public.blog_reaction_count_trf();
+
+CREATE OR REPLACE FUNCTION public.blog_last_comment_trf()
+    RETURNS trigger
+    LANGUAGE 'plpgsql'
+    COST 100
+    VOLATILE NOT LEAKPROOF
+AS $BODY$
+begin
+  if tg_op = 'INSERT' then
+    update blog_entries set last_comment_id = new.id
+      where id = new.entry_id and (last_comment_id is null or last_comment_id < new.id);
+  else
+    update blog_entries set last_comment_id = (select max(id) from blog_comments
+        where entry_id = old.entry_id)
+      where id = old.entry_id and last_comment_id = old.id;
+  end if;
+  return null;
+end;
+$BODY$;
+
+ALTER FUNCTION public.blog_last_comment_trf()
+    OWNER TO postgres;
+
+GRANT EXECUTE ON FUNCTION public.blog_last_comment_trf() TO PUBLIC;
+
+GRANT EXECUTE ON FUNCTION public.blog_last_comment_trf() TO postgres;
+
+GRANT EXECUTE ON FUNCTION public.blog_last_comment_trf() TO www;
+
+CREATE TRIGGER blog_comments_last_comment_tr
+    AFTER INSERT OR DELETE
+    ON public.blog_comments
+    FOR EACH ROW
+    EXECUTE FUNCTION public.blog_last_comment_trf();
+
+CREATE OR REPLACE FUNCTION public.blog_modified_trf()
+    RETURNS trigger
+    LANGUAGE 'plpgsql'
+    COST 100
+    VOLATILE NOT LEAKPROOF
+AS $BODY$
+begin
+  update users set blog_modified = timezone('utc'::text, now())
+    where callsign = coalesce(new.user, old.user);
+  return null;
+end;
+$BODY$;
+
+ALTER FUNCTION public.blog_modified_trf()
+    OWNER TO postgres;
+
+GRANT EXECUTE ON FUNCTION public.blog_modified_trf() TO PUBLIC;
+
+GRANT EXECUTE ON FUNCTION public.blog_modified_trf() TO postgres;
+
+GRANT EXECUTE ON FUNCTION public.blog_modified_trf() TO www;
+
+CREATE TRIGGER blog_entries_modified_tr
+    AFTER INSERT OR DELETE OR UPDATE
+    ON public.blog_entries
+    FOR EACH ROW
+    EXECUTE FUNCTION public.blog_modified_trf();
@@ -0,0 +1 @@
+ALTER TABLE IF EXISTS public.blog_entries DROP COLUMN IF EXISTS variants;
@@ -0,0 +1,2 @@
+ALTER TABLE IF EXISTS public.blog_entries
+    ADD COLUMN variants jsonb;
@@ -0,0 +1,5 @@
+DROP INDEX IF EXISTS public.qth_now_locations_tstamp_idx;
+
+DROP INDEX IF EXISTS public.qth_now_locations_callsign_tstamp_idx;
+
+ALTER TABLE IF EXISTS public.qth_now_locations DROP COLUMN IF EXISTS callsign;
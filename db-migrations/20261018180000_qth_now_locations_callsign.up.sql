@@ -0,0 +1,8 @@
+ALTER TABLE public.qth_now_locations
+    ADD COLUMN callsign character varying;
+
+CREATE INDEX qth_now_locations_callsign_tstamp_idx
+    ON public.qth_now_locations USING btree (callsign, tstamp);
+
+CREATE INDEX qth_now_locations_tstamp_idx
+    ON public.qth_now_locations USING btree (tstamp);
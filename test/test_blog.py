@@ -9,6 +9,7 @@ import httpx
 import pytest
 
 from tnxqso.common import WEB_ADDRESS
+from tnxqso.services.media import derived_media_files, VARIANT_WIDTHS, VARIANT_FORMATS
 
 TEST_USER1_CALLSIGN = "q0001"
 
@@ -20,3 +21,29 @@ async def test_quota(tnxqso_request, user_login):
     loc_rsp.raise_for_status()
     loc_data = json.loads(loc_rsp.text)
     logging.debug(loc_data)
+
+@pytest.mark.asyncio
+async def test_blog_feed_not_modified(tnxqso_request):
+    feed_rsp = await tnxqso_request(f'aiohttp/blog/{TEST_USER1_CALLSIGN}', method='GET',
+            params={'limit': 1})
+    if feed_rsp.status_code == 404:
+        pytest.skip('test user has no blog entries')
+    feed_rsp.raise_for_status()
+    assert len(json.loads(feed_rsp.text)) == 1
+    not_modified_rsp = await tnxqso_request(f'aiohttp/blog/{TEST_USER1_CALLSIGN}',
+            method='GET', headers={'If-Modified-Since': feed_rsp.headers['Last-Modified']})
+    assert not_modified_rsp.status_code == 304
+
+@pytest.mark.asyncio
+async def test_blog_feed_empty_page(tnxqso_request):
+    feed_rsp = await tnxqso_request(f'aiohttp/blog/{TEST_USER1_CALLSIGN}', method='GET',
+            params={'before': 1})
+    feed_rsp.raise_for_status()
+    assert json.loads(feed_rsp.text) == []
+    assert 'X-Next-Before' not in feed_rsp.headers
+
+def test_derived_media_files():
+    derived = derived_media_files('1700000000.jpg')
+    assert '1700000000_thumb.jpeg' in derived
+    assert all(f'1700000000_{width}.{fmt}' in derived
+        for width in VARIANT_WIDTHS for fmt in VARIANT_FORMATS)
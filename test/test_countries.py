@@ -0,0 +1,19 @@
+#!/usr/bin/python
+#coding=utf-8
+
+import pytest
+
+from tnxqso.services.countries import CountryResolver
+
+@pytest.mark.asyncio
+async def test_countries_batch():
+    resolver = CountryResolver(3, 100)
+    await resolver.start()
+    #Moscow, Sevastopol, Kyiv, Moscow rounded to the same cell
+    countries = await resolver.get_countries([[55.75, 37.62], [44.6, 33.52], [50.45, 30.52],
+        [55.7501, 37.6201]])
+    assert countries == ['RU', 'RU', 'UA', 'RU']
+    assert resolver.stats()['batches'] == 1
+    assert await resolver.get_countries([[55.75, 37.62]]) == ['RU']
+    assert resolver.stats()['batches'] == 1
+    resolver.stop()
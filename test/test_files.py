@@ -0,0 +1,72 @@
+#!/usr/bin/python
+#coding=utf-8
+
+import asyncio
+import json
+import logging
+import os
+import stat
+import time
+
+import pytest
+
+from tnxqso.common import FSYNC_POLICIES, saveJSON, loadJSON
+from tnxqso.services.auth import save_upload
+from tnxqso.services.file_writer import FileWriter
+
+def test_save_json_fsync_benchmark(tmp_path):
+    data = [{'cs': f'CC{idx}CC', 'ts': idx, 'text': 'test message ' * 4}
+            for idx in range(500)]
+    file_path = str(tmp_path / 'data.json')
+    for fsync in FSYNC_POLICIES:
+        started = time.perf_counter()
+        for _ in range(100):
+            saveJSON(file_path, data, fsync=fsync)
+        logging.info("100 json writes, fsync %s: %.3f s", fsync,
+                time.perf_counter() - started)
+        assert loadJSON(file_path) == data
+    assert os.listdir(tmp_path) == ['data.json']
+
+def test_save_json_keeps_old_file_on_error(tmp_path):
+    file_path = str(tmp_path / 'data.json')
+    saveJSON(file_path, {'version': 1})
+    try:
+        saveJSON(file_path, {'version': object()})
+    except TypeError:
+        pass
+    with open(file_path) as f_data:
+        assert json.load(f_data) == {'version': 1}
+    assert os.listdir(tmp_path) == ['data.json']
+
+class UploadField:
+
+    def __init__(self, contents):
+        self.filename = 'upload.jpg'
+        self.headers = {'Content-Type': 'image/jpeg'}
+        self.chunks = [contents]
+
+    async def read_chunk(self, _size):
+        return self.chunks.pop(0) if self.chunks else b''
+
+@pytest.mark.asyncio
+async def test_save_upload_mode(tmp_path):
+    upload = await save_upload(UploadField(b'0' * 1024), str(tmp_path), 2048)
+    assert upload.size == 1024
+    assert stat.S_IMODE(os.stat(upload.path).st_mode) == 0o644
+    os.unlink(upload.path)
+
+@pytest.mark.asyncio
+async def test_file_writer_concurrent_flush(tmp_path):
+    file_path = str(tmp_path / 'status.json')
+    writer = FileWriter(60)
+    writer.start()
+    writer.write(file_path, json.dumps({'version': 1}))
+    first = asyncio.create_task(writer.flush())
+    await asyncio.sleep(0)
+    writer.write(file_path, json.dumps({'version': 2}))
+    second = asyncio.create_task(writer.flush())
+    await asyncio.sleep(0)
+    assert await writer.load_json(file_path) == {'version': 2}
+    await asyncio.gather(first, second)
+    await writer.stop()
+    assert loadJSON(file_path) == {'version': 2}
@@ -0,0 +1,95 @@
+#!/usr/bin/python
+#coding=utf-8
+
+import json
+import logging
+import os
+import random
+import time
+
+import httpx
+import pytest
+
+from tnxqso.lib.geo_index import Layer, Polygon, load_geojson_layer
+
+WFS_URL = ('https://map.r1cf.ru/geoserver/cite/wfs?SERVICE=WFS&REQUEST=GetFeature' +
+    '&TypeName=RDA_2025X&VERSION=1.1.0&CQL_FILTER=DWITHIN%28geom,POINT%28{lat}%20{lng}%29' +
+    ',0.25,kilometers%29')
+
+def grid_layer(size=100, step=0.1):
+    """size x size square cells starting at 30, 50 (lng, lat), the first cell has a hole"""
+    features = []
+    for row in range(size):
+        for col in range(size):
+            x, y = 30 + col * step, 50 + row * step
+            rings = [[(x, y), (x + step, y), (x + step, y + step), (x, y + step), (x, y)]]
+            if not row and not col:
+                rings.append([(x + step / 4, y + step / 4), (x + step * 3 / 4, y + step / 4),
+                    (x + step * 3 / 4, y + step * 3 / 4), (x + step / 4, y + step * 3 / 4),
+                    (x + step / 4, y + step / 4)])
+            features.append((f"{row:02}-{col:02}", [Polygon(rings)]))
+    return Layer(features)
+
+def test_geo_index_lookup():
+    layer = grid_layer(10)
+    assert layer.lookup(50.15, 30.25) == ['01-02']
+    #hole of the first cell
+    assert layer.lookup(50.05, 30.05) == []
+    assert layer.lookup(50.05, 30.05, 250) == []
+    #~70 m from the hole edge
+    assert layer.lookup(50.05, 30.074, 250) == ['00-00']
+    #~550 m from the cell border
+    assert layer.lookup(50.155, 30.25, 250) == ['01-02']
+    #~110 m from the cell border
+    assert layer.lookup(50.199, 30.25, 250) == ['01-02', '02-02']
+    assert layer.lookup(50.15, 29.99) == []
+    assert layer.lookup(50.15, 29.99, 250) == []
+
+def test_geo_index_geojson(tmp_path):
+    path = str(tmp_path / 'rda.geojson')
+    with open(path, 'w') as f_layer:
+        json.dump({'type': 'FeatureCollection', 'features': [
+            {'type': 'Feature', 'properties': {'rda': 'MO-01'}, 'geometry': {
+                'type': 'MultiPolygon', 'coordinates': [
+                    [[[37, 55], [38, 55], [38, 56], [37, 56], [37, 55]]],
+                    [[[39, 55], [40, 55], [40, 56], [39, 56], [39, 55]]]]}},
+            {'type': 'Feature', 'properties': {'rda': 'MO-02'}, 'geometry': {
+                'type': 'Polygon', 'coordinates': [
+                    [[38, 55], [39, 55], [39, 56], [38, 56], [38, 55]]]}}]}, f_layer)
+    layer = load_geojson_layer(path, 'rda')
+    assert layer.lookup(55.5, 39.5) == ['MO-01']
+    assert layer.lookup(55.5, 38.5) == ['MO-02']
+    assert layer.lookup(55.5, 38.001, 250) == ['MO-01', 'MO-02']
+
+def test_geo_index_benchmark():
+    layer = grid_layer()
+    points = [(random.uniform(49.9, 60.1), random.uniform(29.9, 40.1)) for _ in range(10000)]
+    for distance in (0, 250):
+        started = time.perf_counter()
+        results = [layer.lookup(lat, lng, distance) for lat, lng in points]
+        duration = time.perf_counter() - started
+        logging.info("10000 local lookups over 10000 polygons, distance %s: %.3f s",
+                distance, duration)
+        #the remote wfs takes tens of milliseconds per lookup
+        assert duration < 10
+        #the index finds the same features as the full scan
+        polygons = [polygon for _, polygon in layer.index.search(-180, -90, 180, 90)]
+        for (lat, lng), result in list(zip(points, results))[:20]:
+            assert len(result) == sum(1 for polygon in polygons
+                if (polygon.within(lng, lat, distance) if distance
+                    else polygon.contains(lng, lat)))
+
+@pytest.mark.skipif(not os.environ.get('TNXQSO_REMOTE_TESTS'),
+        reason='queries the remote wfs, set TNXQSO_REMOTE_TESTS=1 to run')
+def test_geo_index_wfs_latency():
+    latencies = []
+    with httpx.Client(timeout=5) as client:
+        for _ in range(10):
+            started = time.perf_counter()
+            rsp = client.get(WFS_URL.format(lat=random.uniform(55, 56),
+                lng=random.uniform(37, 38)))
+            latencies.append(time.perf_counter() - started)
+            rsp.raise_for_status()
+            assert '<cite:rda>' in rsp.text
+    logging.info("10 wfs lookups: avg %.3f s, max %.3f s",
+            sum(latencies) / len(latencies), max(latencies))
@@ -4,19 +4,47 @@
 import json
 import logging
 import asyncio
+import os
+import time
 from datetime import datetime, timedelta
 
 import httpx
 import pytest
 
 from tnxqso.common import WEB_ADDRESS, tzOffset
-from tnxqso.services.station_dir import read_station_file
+from tnxqso.services.station_dir import read_station_file, get_station_path_by_admin_cs
+from tnxqso.routes.qso_log import (merge_qsos, AdifReader, adif_to_qso, adif_header,
+        adif_record, qso_db_key, drop_not_inserted)
 
 TEST_USER1_CALLSIGN = "qq3qq"
 
+async def station_files_state(callsign, file_names):
+    station_path = await get_station_path_by_admin_cs(callsign)
+    state = []
+    for file_name in file_names:
+        try:
+            file_stat = os.stat(f"{station_path}/{file_name}")
+            state.append((file_stat.st_ino, file_stat.st_mtime_ns))
+        except FileNotFoundError:
+            state.append(None)
+    return state
+
+async def wait_station_files_written(callsign, file_names, prev_state, timeout=10):
+    """the server writes station files in the background,
+    every write replaces the file, so all of them should change"""
+    deadline = time.monotonic() + timeout
+    while True:
+        state = await station_files_state(callsign, file_names)
+        if all(cur != prev for cur, prev in zip(state, prev_state)):
+            return
+        assert time.monotonic() < deadline, f"{file_names} were not written in {timeout} s"
+        await asyncio.sleep(0.1)
+
 @pytest.mark.asyncio
 async def test_valid_qso(tnxqso_request, user_login):
     TEST_USER1_TOKEN = (await user_login(TEST_USER1_CALLSIGN))['token']
+    station_files = ['log.json', 'status.json']
+    prev_state = await station_files_state(TEST_USER1_CALLSIGN, station_files)
     qso = {
         "myCS": "R6TEST",
         "band": "14",
@@ -40,6 +68,7 @@ async def test_valid_qso(tnxqso_request, user_login):
                 'qso': [qso]
                 })
     log_rsp.raise_for_status()
+    await wait_station_files_written(TEST_USER1_CALLSIGN, station_files, prev_state)
     log = await read_station_file(TEST_USER1_CALLSIGN, 'log.json')
     qso_datetime = datetime.strptime(qso['ts'], "%Y-%m-%d %H:%M:%S")
     assert log[0]['qso_ts'] == (qso_datetime - datetime(1970, 1, 1)) / timedelta(seconds=1)
@@ -47,4 +76,156 @@ async def test_valid_qso(tnxqso_request, user_login):
     assert status['freq']['value'] == qso['freq']
     assert abs(status['freq']['ts'] - (qso_datetime.timestamp() + tzOffset())) < 1
 
+@pytest.mark.asyncio
+async def test_log_search_pages(tnxqso_request):
+    search_rsp = await tnxqso_request('aiohttp/logSearch',
+            json={'station': TEST_USER1_CALLSIGN, 'callsign': 'CC*', 'limit': 1, 'count': True})
+    search_rsp.raise_for_status()
+    page = json.loads(search_rsp.text)
+    assert len(page) == 1
+    assert page[0]['cs'].startswith('CC')
+    assert int(search_rsp.headers['X-Total-Count']) >= 1
+    if 'X-Next-Before' in search_rsp.headers:
+        next_rsp = await tnxqso_request('aiohttp/logSearch',
+                json={'station': TEST_USER1_CALLSIGN, 'callsign': 'CC*', 'limit': 1,
+                    'before': search_rsp.headers['X-Next-Before']})
+        next_rsp.raise_for_status()
+        assert json.loads(next_rsp.text) != page
+
+@pytest.mark.asyncio
+async def test_log_search_invalid_limit(tnxqso_request):
+    for limit in (0, -1, 'a'):
+        search_rsp = await tnxqso_request('aiohttp/logSearch',
+                json={'station': TEST_USER1_CALLSIGN, 'callsign': 'CC*', 'limit': limit})
+        assert search_rsp.status_code == 400
+
+@pytest.mark.asyncio
+async def test_adif_export_unknown_station(tnxqso_request):
+    export_rsp = await tnxqso_request('aiohttp/adif/NO0STATION', method='GET')
+    export_rsp.raise_for_status()
+    assert adif_calls(export_rsp.text) == []
+
+def adif_calls(adif):
+    return [record.split('<CALL:')[1].split('>')[1].split(' ')[0]
+        for record in adif.split('<EOH>')[1].split('<EOR>') if '<CALL:' in record]
+
+@pytest.mark.asyncio
+async def test_adif_export_cache(tnxqso_request, user_login):
+    """exports are newest first with or without the cache"""
+    TEST_USER1_TOKEN = (await user_login(TEST_USER1_CALLSIGN))['token']
+    export_url = f'aiohttp/adif/{TEST_USER1_CALLSIGN}'
+    (await tnxqso_request(export_url, method='GET')).raise_for_status()
+    callsign = f"CC{int(time.time()) % 100000}CC"
+    log_rsp = await tnxqso_request('aiohttp/log',
+            json={'token': TEST_USER1_TOKEN,
+                'qso': [{
+                    "myCS": "R6TEST",
+                    "band": "14",
+                    "freq": "14000.0",
+                    "mode": "CW",
+                    "cs": callsign,
+                    "snt": "599",
+                    "rcv": "599",
+                    "no": 1,
+                    "loc": None,
+                    "comments": "",
+                    "qth": ["", "", ""],
+                    "loc_rcv": None,
+                    "sound": None,
+                    "date": "06 dec",
+                    "time": "16:57z",
+                    "ts": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+                    }]
+                })
+    log_rsp.raise_for_status()
+    export_rsp = await tnxqso_request(export_url, method='GET')
+    export_rsp.raise_for_status()
+    assert adif_calls(export_rsp.text)[0] == callsign
+    cached_rsp = await tnxqso_request(export_url, method='GET')
+    cached_rsp.raise_for_status()
+    assert adif_calls(cached_rsp.text) == adif_calls(export_rsp.text)
+
+def generate_qsos(count):
+    start = datetime(2023, 12, 6)
+    return [{
+        "myCS": "R6TEST",
+        "band": "14",
+        "freq": "14000.0",
+        "mode": "CW",
+        "cs": f"CC{idx}CC",
+        "snt": "599",
+        "rcv": "599",
+        "no": idx,
+        "loc": None,
+        "comments": "",
+        "qth": ["", "", ""],
+        "loc_rcv": None,
+        "sound": None,
+        "ts": (start + timedelta(seconds=idx)).strftime("%Y-%m-%d %H:%M:%S")
+        } for idx in range(count)]
+
+def test_merge_qsos_benchmark():
+    log = []
+    started = time.perf_counter()
+    processed, db_updates, db_inserts = merge_qsos(log, generate_qsos(10000))
+    logging.info("10k new qsos merge: %.3f s", time.perf_counter() - started)
+    assert len(log) == len(db_inserts) == 10000
+    assert not db_updates
+    assert len({qso['ts'] for qso in log}) == 10000
+
+    started = time.perf_counter()
+    reprocessed, db_updates, db_inserts = merge_qsos(log, generate_qsos(10000))
+    logging.info("10k duplicate qsos merge: %.3f s", time.perf_counter() - started)
+    assert not db_inserts and not db_updates
+    assert len(log) == 10000
+    assert [qso['ts'] for qso in reprocessed] == [qso['ts'] for qso in processed]
+
+def test_adif_reader_chunks():
+    adif = ("ADIF Export from TNXLOG\n<EOH>\n" +
+        "<CALL:5>CC1CC <QSO_DATE:8>20231206 <TIME_ON:6>165710 <BAND:3>20M " +
+        "<FREQ:6>14.074 <MODE:2>CW <MY_CITY:12>Москва <EOR>\r\n" +
+        "<call:4>R1AV <qso_date:8>20231207 <time_on:4>0102 <band:3>40m <eor>").encode()
+    reader = AdifReader()
+    records = []
+    for idx in range(0, len(adif), 7):
+        records += reader.feed(adif[idx:idx + 7].decode('latin-1'))
+    qsos = [adif_to_qso(record) for record in records]
+    assert len(qsos) == 2
+    assert qsos[0]['ts'] == '2023-12-06 16:57:10'
+    assert qsos[0]['band'] == '14'
+    assert qsos[0]['freq'] == '14074.000'
+    assert qsos[0]['qth'][1] == 'Москва'
+    assert qsos[1]['cs'] == 'R1AV'
+    assert qsos[1]['band'] == '7'
 
+def test_adif_reimport_no_duplicates():
+    log = []
+    merge_qsos(log, generate_qsos(1))
+    adif = adif_header() + adif_record(log[0])
+    qsos = [adif_to_qso(record) for record in AdifReader().feed(adif)]
+    _, _, db_inserts = merge_qsos(log, qsos)
+    #the upsert finds the stored qso by (cs, qso_ts, band) and returns its ts
+    stored = {qso_db_key(log_qso): log_qso['ts'] for log_qso in log
+        if log_qso not in db_inserts}
+    for qso in db_inserts:
+        qso['ts'] = stored[qso_db_key(qso)]
+    drop_not_inserted(log, db_inserts, [])
+    assert len(log) == 1
+    assert len({qso['ts'] for qso in log}) == 1
+
+@pytest.mark.asyncio
+async def test_adif_reimport_export(tnxqso_request, user_login):
+    TEST_USER1_TOKEN = (await user_login(TEST_USER1_CALLSIGN))['token']
+    export_rsp = await tnxqso_request(f'aiohttp/adif/{TEST_USER1_CALLSIGN}', method='GET')
+    export_rsp.raise_for_status()
+    station_files = ['log.json']
+    prev_state = await station_files_state(TEST_USER1_CALLSIGN, station_files)
+    import_rsp = await tnxqso_request('aiohttp/adif',
+            data={'token': TEST_USER1_TOKEN},
+            files={'file': ('export.adi', export_rsp.content, 'application/octet-stream')})
+    import_rsp.raise_for_status()
+    assert json.loads(import_rsp.text)['inserted'] == 0
+    await wait_station_files_written(TEST_USER1_CALLSIGN, station_files, prev_state)
+    log = await read_station_file(TEST_USER1_CALLSIGN, 'log.json')
+    assert len({qso['ts'] for qso in log}) == len(log)
+    assert len({qso_db_key(qso) for qso in log}) == len(log)
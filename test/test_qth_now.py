@@ -0,0 +1,44 @@
+#!/usr/bin/python
+#coding=utf-8
+
+import json
+import time
+
+import pytest
+
+from tnxqso.services.qth_now import QthNowLocations, history_params
+
+def test_qth_now_locations():
+    locations = QthNowLocations(None, 600)
+    now = int(time.time())
+    locations.update('R1AA', [55.75, 37.62], now - 700)
+    locations.update('R1BB', [56.0, 38.0], now)
+    #the same location replaces the entry of the other callsign
+    locations.update(None, [56.0, 38.0], now)
+    locations.update('R1CC', [50.0, 30.0], now)
+    locations.update('R1CC', [51.0, 31.0], now)
+    assert [(entry['callsign'], entry['location']) for entry in locations.snapshot()] ==\
+        [(None, [56.0, 38.0]), ('R1CC', [51.0, 31.0])]
+    assert [entry['callsign'] for entry in locations.query(50.5, 30.5, 52, 32)] == ['R1CC']
+
+@pytest.mark.asyncio
+async def test_qth_now_locations_export(tmp_path):
+    path = str(tmp_path / 'qth_now_locations.json')
+    locations = QthNowLocations(path, 600)
+    locations.update('R1AA', [55.75, 37.62])
+    await locations.save()
+    with open(path) as f_locations:
+        assert [entry['callsign'] for entry in json.load(f_locations)] == ['R1AA']
+    restored = QthNowLocations(path, 600)
+    await restored.load()
+    assert [entry['callsign'] for entry in restored.snapshot()] == ['R1AA']
+
+def test_qth_now_history_params():
+    assert history_params([('R1AA', 55.75, 37.62, 'MO-01', 1700000000),
+        (None, 56.0, 38.0, None, 1700000001)]) == {
+            'callsigns': ['R1AA', None],
+            'lats': [55.75, 56.0],
+            'lngs': [37.62, 38.0],
+            'rdas': ['MO-01', None],
+            'tss': [1700000000, 1700000001]
+            }
@@ -0,0 +1,34 @@
+#!/usr/bin/python
+#coding=utf-8
+
+import pytest
+
+from tnxqso.services.spatial_cache import SpatialCache
+
+def test_spatial_cache_lru():
+    cache = SpatialCache(60, 2)
+    cache.put('rda:dwithin:KO85TS00', ['MO-01'])
+    cache.put('rda:dwithin:KO85TS01', ['MO-02'])
+    assert cache.get('rda:dwithin:KO85TS00') == ['MO-01']
+    cache.put('rda:dwithin:KO85TS02', ['MO-03'])
+    assert cache.get('rda:dwithin:KO85TS01') is None
+    assert cache.get('rda:dwithin:KO85TS00') == ['MO-01']
+    assert cache.stats()['evicted'] == 1
+
+def test_spatial_cache_ttl():
+    cache = SpatialCache(-1, 10)
+    cache.put('rda:dwithin:KO85TS00', ['MO-01'])
+    assert cache.get('rda:dwithin:KO85TS00') is None
+    assert cache.stats()['expired'] == 1
+
+@pytest.mark.asyncio
+async def test_spatial_cache_persistence(tmp_path):
+    path = str(tmp_path / 'wfs_cache.json')
+    cache = SpatialCache(60, 10, path=path)
+    await cache.start()
+    cache.put('rda:intersects:KO85TS00', ['MO-01'])
+    await cache.stop()
+    restored = SpatialCache(60, 10, path=path)
+    await restored.start()
+    assert restored.get('rda:intersects:KO85TS00') == ['MO-01']
+    await restored.stop()
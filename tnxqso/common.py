@@ -2,7 +2,7 @@
 #coding=utf-8
 
 
-import configparser, decimal, logging, logging.handlers, os
+import configparser, decimal, logging, logging.handlers, os, tempfile
 from os import path
 from datetime import datetime, date
 from functools import partial
@@ -42,6 +42,40 @@ def loadJSON( pathJS ):
         logging.exception( ex )
         return False
 
+FSYNC_POLICIES = ('none', 'file', 'full')
+FSYNC_POLICY = CONF.get('files', 'fsync', fallback='file')
+
+def write_file_atomic(file_path, contents, fsync=None):
+    """writes to a temporary file in the same directory and renames it over file_path
+    so readers never see a partially written file
+    fsync policy: none - leave it to the os; file - sync the data before the rename;
+    full - also sync the directory after the rename"""
+    fsync = fsync or FSYNC_POLICY
+    dir_path = path.dirname(file_path) or '.'
+    binary = isinstance(contents, bytes)
+    fd, tmp_path = tempfile.mkstemp(dir=dir_path, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb' if binary else 'w') as f_tmp:
+            f_tmp.write(contents)
+            if fsync != 'none':
+                f_tmp.flush()
+                os.fsync(f_tmp.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    if fsync == 'full':
+        dir_fd = os.open(dir_path, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+def saveJSON(pathJS, data, fsync=None):
+    write_file_atomic(pathJS, json.dumps(data, ensure_ascii=False), fsync=fsync)
+
 DEF_USER_SETTINGS = loadJSON(WEB_ROOT + '/js/defaultUserSettings.json') or {}
 
 json_dumps = partial(json.dumps, default=jsonEncodeExtra)
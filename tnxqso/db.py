@@ -1,14 +1,34 @@
 #!/usr/bin/python3
 #coding=utf-8
 
+import asyncio
+import copy
 import logging
+import re
+import time
 import traceback
 import json
+import weakref
+from contextlib import asynccontextmanager
+from functools import lru_cache
 
 import aiopg
 
 from tnxqso.common import CONF
 
+#sqlstate of "cached plan must not change result type"
+CACHED_PLAN_CHANGED = '0A000'
+
+#[db] section keys which configure the pool and caches and are not passed to the dsn
+DB_OPTIONS = {
+    'pool_minsize': 1,
+    'pool_maxsize': 10,
+    'pool_acquire_timeout': 5,
+    'statement_timeout': 0,
+    'user_cache_ttl': 60,
+    'user_cache_size': 1000
+    }
+
 async def to_dict(cur, container=None, key_column='id'):
     if not cur or not cur.rowcount:
         return False
@@ -25,8 +45,42 @@ async def to_dict(cur, container=None, key_column='id'):
 
     return [dict(zip(col_names, row)) for row in data]
 
+RE_NAMED_PARAM = re.compile(r"%\((\w+)\)s")
+
+@lru_cache(maxsize=256)
+def _param_str(keys, delim):
+    return delim.join([f"{x} = %({x})s" for x in keys])
+
 def param_str(params, delim):
-    return delim.join([f"{x} = %({x})s" for x in params.keys()])
+    return _param_str(tuple(params.keys()), delim)
+
+@lru_cache(maxsize=256)
+def _select_sql(table, keys, null_keys):
+    where_clause = " and ".join([f"{k} is null" if k in null_keys else f"{k} = %({k})s"
+        for k in keys])
+    return f"""
+        select * from {table}
+        where {where_clause}"""
+
+@lru_cache(maxsize=256)
+def _insert_sql(table, keys):
+    return f"""
+        insert into {table}
+        ({", ".join(keys)})
+        values ({", ".join([f"%({key})s" for key in keys])})
+        returning *"""
+
+def prepare_sql(sql):
+    """converts pyformat named params to positional $n params of a prepared statement
+    returns the converted sql and the list of param names in positional order"""
+    param_names = []
+
+    def param_placeholder(match):
+        if match.group(1) not in param_names:
+            param_names.append(match.group(1))
+        return f"${param_names.index(match.group(1)) + 1}"
+
+    return RE_NAMED_PARAM.sub(param_placeholder, sql), param_names
 
 def splice_params(data, params):
     return {param: json.dumps(data[param])
@@ -37,17 +91,94 @@ def splice_params(data, params):
 async def init_connection(_conn):
     logging.debug('new db connection')
 
+class Histogram:
+    BOUNDS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, value):
+        idx = 0
+        while idx < len(self.BOUNDS) and value > self.BOUNDS[idx]:
+            idx += 1
+        self.buckets[idx] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def as_dict(self):
+        return {
+            'buckets': {f"le_{bound}": count
+                for bound, count in zip(self.BOUNDS + ('inf',), self.buckets)},
+            'count': self.count,
+            'avg': self.total / self.count if self.count else 0,
+            'max': self.max
+            }
+
+class DBError(Exception):
+    """query failure raised by DBConn.stream, the error is logged before"""
+
+class DBStats:
+    MAX_QUERIES = 200
+
+    def __init__(self):
+        self.waiting = 0
+        self.acquire_timeouts = 0
+        self.acquire_wait = Histogram()
+        self.queries = {}
+        self.prepares = 0
+        self.prepared_hits = 0
+        self.user_cache_hits = 0
+        self.user_cache_misses = 0
+
+    def add_query(self, sql, duration):
+        key = ' '.join(sql.split())[:160]
+        if key not in self.queries:
+            if len(self.queries) >= self.MAX_QUERIES:
+                return
+            self.queries[key] = Histogram()
+        self.queries[key].add(duration)
+
+    def as_dict(self, top=20):
+        queries = sorted(self.queries.items(), key=lambda item: item[1].total, reverse=True)
+        return {
+            'waiting': self.waiting,
+            'acquire_timeouts': self.acquire_timeouts,
+            'acquire_wait': self.acquire_wait.as_dict(),
+            'prepares': self.prepares,
+            'prepared_hits': self.prepared_hits,
+            'user_cache_hits': self.user_cache_hits,
+            'user_cache_misses': self.user_cache_misses,
+            'queries': [dict(hist.as_dict(), sql=sql) for sql, hist in queries[:top]]
+            }
+
 class DBConn:
 
     def __init__(self, db_params):
-        self.dsn = ' '.join([f"{k}='{v}'" for k, v in db_params])
+        db_params = dict(db_params)
+        self.options = {key: float(db_params.pop(key, default))
+            for key, default in DB_OPTIONS.items()}
+        self.dsn = ' '.join([f"{k}='{v}'" for k, v in db_params.items()])
+        if self.options['statement_timeout']:
+            self.dsn += (" options='-c statement_timeout=" +
+                f"{int(self.options['statement_timeout'] * 1000)}'")
         self.verbose = False
         self.pool = None
         self.error = None
+        self.stats = DBStats()
+        self.named_queries = {}
+        self.prepared = weakref.WeakKeyDictionary()
+        self.user_cache = {}
+        self.user_cache_generation = 0
 
     async def connect(self):
         try:
-            self.pool = await aiopg.create_pool(self.dsn, maxsize=3,
+            self.pool = await aiopg.create_pool(self.dsn,
+                    minsize=int(self.options['pool_minsize']),
+                    maxsize=int(self.options['pool_maxsize']),
                     on_connect = init_connection)
             logging.debug('db connections pool is created')
         except:
@@ -60,12 +191,52 @@ class DBConn:
         await self.pool.wait_closed()
         logging.debug('db connections pool was closed')
 
+    @asynccontextmanager
+    async def acquire(self):
+        self.stats.waiting += 1
+        started = time.monotonic()
+        try:
+            conn = await asyncio.wait_for(self.pool.acquire(),
+                    self.options['pool_acquire_timeout'] or None)
+        except asyncio.TimeoutError:
+            self.stats.acquire_timeouts += 1
+            raise
+        finally:
+            self.stats.waiting -= 1
+        self.stats.acquire_wait.add(time.monotonic() - started)
+        try:
+            yield conn
+        finally:
+            await self.pool.release(conn)
+
+    def register_query(self, name, sql):
+        """registers fixed sql which is prepared once per connection
+        and can be run by name with execute_named"""
+        self.named_queries[name] = prepare_sql(sql)
+
+    def pool_stats(self):
+        stats = self.stats.as_dict()
+        if self.pool:
+            stats.update({
+                'size': self.pool.size,
+                'free': self.pool.freesize,
+                'in_use': self.pool.size - self.pool.freesize,
+                'minsize': self.pool.minsize,
+                'maxsize': self.pool.maxsize
+                })
+        return stats
+
     async def param_update(self, table, id_params, upd_params):
-        return await self.execute(f"""
+        res = await self.execute(f"""
                 update {table}
                 set {param_str(upd_params, ', ')}
                 where {param_str(id_params, ' and ')}""",
                 dict(id_params, **upd_params))
+        if table == 'users':
+            #banned_by of the other logins depends on the email
+            self.invalidate_user_data(None if 'email' in upd_params
+                    else id_params.get('callsign'))
+        return res
 
     async def param_delete(self, table, id_params):
         return await self.execute(f"""
@@ -83,63 +254,153 @@ class DBConn:
                     True)
         return res
 
+    async def _cursor_execute(self, cur, sql, params, container, key_column,
+            reraise_codes=(), reraise=False):
+        """errors are logged and False is returned,
+        errors with sqlstate in reraise_codes are raised to the caller,
+        if reraise is set all errors are raised (as DBError) after logging"""
+        res = False
+        started = time.monotonic()
+        try:
+            if self.verbose:
+                logging.debug(sql)
+                logging.debug(params)
+            await cur.execute(sql, params)
+            res = (await to_dict(cur, container, key_column)
+                    if cur.description is not None else True)
+        except Exception as exc:
+            if getattr(exc, 'pgcode', None) in reraise_codes:
+                self.stats.add_query(sql, time.monotonic() - started)
+                raise
+            logging.exception("Error executing: %s", sql)
+            stack = traceback.extract_stack()
+            logging.error(stack)
+            if params:
+                logging.error("Params: %s", params)
+            if hasattr(exc, 'pgerror'):
+                logging.error(exc.pgerror)
+                self.error = exc.pgerror
+            if reraise:
+                self.stats.add_query(sql, time.monotonic() - started)
+                raise DBError(f"Error executing: {sql}") from exc
+        self.stats.add_query(sql, time.monotonic() - started)
+        return res
+
     async def execute(self, sql, params=None, container=None, key_column=None):
         res = False
-        with (await self.pool.cursor()) as cur:
-            try:
-                if self.verbose:
-                    logging.debug(sql)
-                    logging.debug(params)
-                await cur.execute(sql, params)
-                res = (await to_dict(cur, container, key_column)
-                        if cur.description is not None else True)
-            except Exception as exc:
-                logging.exception("Error executing: %s", sql)
-                stack = traceback.extract_stack()
-                logging.error(stack)
-                if params:
-                    logging.error("Params: %s", params)
-                if hasattr(exc, 'pgerror'):
-                    logging.error(exc.pgerror)
-                    self.error = exc.pgerror
+        try:
+            async with self.acquire() as conn:
+                async with conn.cursor() as cur:
+                    res = await self._cursor_execute(cur, sql, params, container, key_column)
+        except asyncio.TimeoutError:
+            logging.error("Timeout acquiring db connection for: %s", sql)
         return res
 
+    async def _prepare(self, cur, prepared, name, sql):
+        if not await self._cursor_execute(cur, f"prepare {name} as {sql}",
+                None, None, None):
+            return False
+        prepared.add(name)
+        self.stats.prepares += 1
+        return True
+
+    async def execute_named(self, name, params=None, container=None, key_column=None):
+        sql, param_names = self.named_queries[name]
+        params = params or {}
+        execute_sql = (f"execute {name} ({', '.join(['%s'] * len(param_names))})"
+            if param_names else f"execute {name}")
+        values = [params[param] for param in param_names]
+        res = False
+        try:
+            async with self.acquire() as conn:
+                prepared = self.prepared.setdefault(conn, set())
+                async with conn.cursor() as cur:
+                    if name in prepared:
+                        self.stats.prepared_hits += 1
+                    elif not await self._prepare(cur, prepared, name, sql):
+                        return False
+                    try:
+                        res = await self._cursor_execute(cur, execute_sql, values,
+                                container, key_column, reraise_codes=(CACHED_PLAN_CHANGED,))
+                    except Exception:
+                        #the tables were altered after the statement was prepared
+                        #on this connection, the statement is prepared again
+                        logging.warning("Result type of prepared %s changed, preparing again",
+                                name)
+                        await self._cursor_execute(cur, f"deallocate {name}",
+                                None, None, None)
+                        prepared.discard(name)
+                        if await self._prepare(cur, prepared, name, sql):
+                            res = await self._cursor_execute(cur, execute_sql, values,
+                                    container, key_column)
+        except asyncio.TimeoutError:
+            logging.error("Timeout acquiring db connection for: %s", name)
+        return res
+
+    async def stream(self, sql, params=None, chunk_size=1000):
+        """reads query results through a server-side cursor
+        yields lists of row dicts of up to chunk_size rows
+        raises DBError if the query fails at any point, so a partial result
+        is never taken for a complete one"""
+        try:
+            async with self.acquire() as conn:
+                async with conn.cursor() as cur:
+                    await self._cursor_execute(cur, 'begin', None, None, None, reraise=True)
+                    try:
+                        await self._cursor_execute(cur,
+                                f"declare stream_cursor no scroll cursor for {sql}",
+                                params, None, None, reraise=True)
+                        while True:
+                            rows = await self._cursor_execute(cur,
+                                    f"fetch {chunk_size} from stream_cursor",
+                                    None, 'list', None, reraise=True)
+                            if not rows:
+                                break
+                            yield rows
+                    finally:
+                        await self._cursor_execute(cur, 'rollback', None, None, None)
+        except asyncio.TimeoutError:
+            logging.error("Timeout acquiring db connection for: %s", sql)
+            raise DBError(f"Timeout acquiring db connection for: {sql}")
+
     async def get_station_callsign(self, admin_cs):
         data = await self.get_user_data(admin_cs)
         return data['settings']['station']['callsign']
 
     async def get_user_data(self, callsign):
-        user_data = await self.get_object('users', {'callsign': callsign}, False, True)
-        if user_data:
-            user_data['banned_by'] = (await self.execute("""
-                select array_agg(admin_callsign) as admins 
-                from user_bans join users on banned_callsign = callsign
-                where email = (select email from users as u1 where u1.callsign = %(callsign)s);
-                """, {'callsign': callsign})).get('admins', [])
+        now = time.monotonic()
+        cached = self.user_cache.get(callsign)
+        if cached and cached[0] > now:
+            self.stats.user_cache_hits += 1
+            return copy.deepcopy(cached[1])
+        self.stats.user_cache_misses += 1
+        generation = self.user_cache_generation
+        user_data = await self.execute_named('user_data', {'callsign': callsign})
+        if (user_data and self.options['user_cache_ttl'] and
+                generation == self.user_cache_generation):
+            if len(self.user_cache) >= self.options['user_cache_size']:
+                self.user_cache = {key: val for key, val in self.user_cache.items()
+                        if val[0] > now}
+            self.user_cache[callsign] = (now + self.options['user_cache_ttl'],
+                    copy.deepcopy(user_data))
         return user_data
 
+    def invalidate_user_data(self, callsign=None):
+        """drops cached user data of the callsign or of all users if callsign is None"""
+        self.user_cache_generation += 1
+        if callsign is None:
+            self.user_cache.clear()
+        else:
+            self.user_cache.pop(callsign, None)
+
     async def get_object(self, table, params, create=False, never_create=False):
-        sql = ''
         res = False
         if not create:
-            where_clause = " and ".join([f"{k} = %({k})s"
-                        if params[k] is not None
-                        else f"{k} is null"
-                        for k in params.keys()])
-            sql = f"""
-                select * from {table} 
-                where {where_clause}"""
-            res = await self.execute(sql, params)
+            res = await self.execute(_select_sql(table, tuple(params.keys()),
+                    tuple(k for k in params.keys() if params[k] is None)), params)
         if create or (not res and not never_create):
-            keys = ", ".join(params.keys())
-            values = ", ".join([f"%({key})s" for key in params.keys()])
-            sql = f"""
-                insert into {table} 
-                ({keys})
-                values ({values})
-                returning *"""
             logging.debug('creating object in db')
-            res = await self.execute(sql, params)
+            res = await self.execute(_insert_sql(table, tuple(params.keys())), params)
         return res
 
     async def update_object(self, table, update_params, id_param = "id"):
@@ -158,3 +419,11 @@ class DBConn:
         await self.execute(f"delete from {table} where id = %s", (el_id,))
 
 DB = DBConn(CONF.items('db'))
+
+DB.register_query('user_data', """
+    select users.*,
+        (select array_agg(admin_callsign)
+            from user_bans join users as u1 on banned_callsign = u1.callsign
+            where u1.email = users.email) as banned_by
+    from users
+    where callsign = %(callsign)s""")
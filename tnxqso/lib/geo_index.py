@@ -0,0 +1,151 @@
+#!/usr/bin/python3
+#coding=utf-8
+"""offline point-in-polygon lookups over polygon layers
+coordinates are (lng, lat) degrees as in geojson"""
+import json
+import math
+
+METERS_PER_DEGREE = 111320
+RTREE_NODE_SIZE = 16
+
+class RTree:
+    """static r-tree over bounding boxes bulk loaded by sort-tile-recursive
+    items: list of (bbox, value), bbox - (min_x, min_y, max_x, max_y)"""
+
+    def __init__(self, items, node_size=RTREE_NODE_SIZE):
+        self.node_size = node_size
+        level = [(bbox, value) for bbox, value in items]
+        self.height = 0
+        while len(level) > node_size:
+            level = self._pack(level)
+            self.height += 1
+        self.root = level
+
+    def _pack(self, entries):
+        """groups entries into nodes: (bbox, children)"""
+        node_count = math.ceil(len(entries) / self.node_size)
+        slice_count = math.ceil(math.sqrt(node_count))
+        slice_size = slice_count * self.node_size
+        entries = sorted(entries, key=lambda entry: entry[0][0] + entry[0][2])
+        nodes = []
+        for slice_start in range(0, len(entries), slice_size):
+            vertical_slice = sorted(entries[slice_start:slice_start + slice_size],
+                    key=lambda entry: entry[0][1] + entry[0][3])
+            for node_start in range(0, len(vertical_slice), self.node_size):
+                children = vertical_slice[node_start:node_start + self.node_size]
+                nodes.append(((
+                    min(child[0][0] for child in children),
+                    min(child[0][1] for child in children),
+                    max(child[0][2] for child in children),
+                    max(child[0][3] for child in children)),
+                    children))
+        return nodes
+
+    def search(self, min_x, min_y, max_x, max_y):
+        """values of the items which bounding boxes intersect the box"""
+        result = []
+        stack = [(self.root, self.height)]
+        while stack:
+            entries, height = stack.pop()
+            for bbox, child in entries:
+                if bbox[0] <= max_x and bbox[2] >= min_x and bbox[1] <= max_y and bbox[3] >= min_y:
+                    if height:
+                        stack.append((child, height - 1))
+                    else:
+                        result.append(child)
+        return result
+
+def ring_contains(ring, x, y):
+    inside = False
+    x_prev, y_prev = ring[-1]
+    for x_cur, y_cur in ring:
+        if (y_cur > y) != (y_prev > y) and\
+            x < (x_prev - x_cur) * (y - y_cur) / (y_prev - y_cur) + x_cur:
+            inside = not inside
+        x_prev, y_prev = x_cur, y_cur
+    return inside
+
+def ring_within(ring, x, y, dx, dy, distance):
+    """checks if any edge of the ring is closer than distance (meters) to the point,
+    dx, dy - meters per degree of lng, lat at the point"""
+    box_x, box_y = distance / dx, distance / dy
+    x_prev, y_prev = ring[-1]
+    for x_cur, y_cur in ring:
+        if not ((x_cur < x - box_x and x_prev < x - box_x) or
+                (x_cur > x + box_x and x_prev > x + box_x) or
+                (y_cur < y - box_y and y_prev < y - box_y) or
+                (y_cur > y + box_y and y_prev > y + box_y)):
+            #point to segment distance in local meters
+            ax, ay = (x_prev - x) * dx, (y_prev - y) * dy
+            bx, by = (x_cur - x) * dx, (y_cur - y) * dy
+            sx, sy = bx - ax, by - ay
+            length = sx * sx + sy * sy
+            pos = max(0, min(1, -(ax * sx + ay * sy) / length)) if length else 0
+            px, py = ax + pos * sx, ay + pos * sy
+            if px * px + py * py <= distance * distance:
+                return True
+        x_prev, y_prev = x_cur, y_cur
+    return False
+
+class Polygon:
+    """polygon with holes: rings[0] - exterior ring, the rest - holes"""
+
+    def __init__(self, rings):
+        self.rings = [[(float(point[0]), float(point[1])) for point in ring] for ring in rings]
+        exterior = self.rings[0]
+        self.bbox = (min(point[0] for point in exterior), min(point[1] for point in exterior),
+            max(point[0] for point in exterior), max(point[1] for point in exterior))
+
+    def contains(self, x, y):
+        if not ring_contains(self.rings[0], x, y):
+            return False
+        return not any(ring_contains(hole, x, y) for hole in self.rings[1:])
+
+    def within(self, x, y, distance):
+        if self.contains(x, y):
+            return True
+        dx = METERS_PER_DEGREE * math.cos(math.radians(y))
+        return any(ring_within(ring, x, y, dx, METERS_PER_DEGREE, distance)
+                for ring in self.rings)
+
+class Layer:
+    """features: list of (value, list of Polygon) in the layer order"""
+
+    def __init__(self, features):
+        self.values = [value for value, _ in features]
+        self.index = RTree([(polygon.bbox, (feature_idx, polygon))
+            for feature_idx, (_, polygons) in enumerate(features)
+            for polygon in polygons])
+
+    def lookup(self, lat, lng, distance=0):
+        """values of the features containing the point (distance == 0, INTERSECTS)
+        or closer than distance meters to it (DWITHIN)"""
+        box_y = distance / METERS_PER_DEGREE
+        box_x = distance / (METERS_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+        found = set()
+        for feature_idx, polygon in self.index.search(lng - box_x, lat - box_y,
+                lng + box_x, lat + box_y):
+            if feature_idx in found:
+                continue
+            if polygon.within(lng, lat, distance) if distance else polygon.contains(lng, lat):
+                found.add(feature_idx)
+        return [self.values[feature_idx] for feature_idx in sorted(found)]
+
+def load_geojson_layer(path, tag):
+    """reads the layer exported as a geojson feature collection,
+    tag - feature property holding the value"""
+    with open(path) as f_layer:
+        data = json.load(f_layer)
+    features = []
+    for feature in data['features']:
+        geometry = feature.get('geometry')
+        if not geometry:
+            continue
+        if geometry['type'] == 'Polygon':
+            polygons = [Polygon(geometry['coordinates'])]
+        elif geometry['type'] == 'MultiPolygon':
+            polygons = [Polygon(rings) for rings in geometry['coordinates']]
+        else:
+            continue
+        features.append((feature['properties'][tag], polygons))
+    return Layer(features)
@@ -1,15 +1,15 @@
 #!/usr/bin/python3
 #coding=utf-8
-import json
 from datetime import datetime
 import os
 
 from aiohttp import web
 
-from tnxqso.common import WEB_ROOT, loadJSON
+from tnxqso.common import WEB_ROOT
 from tnxqso.services.auth import auth
 from tnxqso.services.rabbitmq import rabbitmq_publish
 from tnxqso.services.station_dir import get_station_path
+from tnxqso.services.file_io import load_json, save_json
 
 ACTIVE_USERS_ROUTES = web.RouteTableDef()
 
@@ -23,7 +23,7 @@ async def active_users_handler(data, *, callsign, request, **_):
         '/settings.json'):
         return web.HTTPBadRequest(text = 'This station was deleted or moved')
     au_path = WEB_ROOT + '/js/activeUsers.json'
-    au_data = loadJSON(au_path) or {}
+    au_data = (await load_json(au_path)) or {}
     now_ts = int(datetime.now().timestamp())
     au_data = {key: val for key, val in au_data.items() if now_ts - val['ts'] < 120}
     au_data[callsign] = {
@@ -36,8 +36,7 @@ async def active_users_handler(data, *, callsign, request, **_):
             'name': data.get('name'),
             'typing': data.get('typing')
             }
-    with open(au_path, 'w') as f_au:
-        json.dump(au_data, f_au, ensure_ascii = False)
+    await save_json(au_path, au_data)
     await rabbitmq_publish(request.app['rabbitmq']['exchanges']['active_users'],
         key='',
         message=au_data[callsign])
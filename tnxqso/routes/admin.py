@@ -1,14 +1,22 @@
 #!/usr/bin/python3
 #coding=utf-8
 
-import json
 
 from aiohttp import web
 
-from tnxqso.common import WEB_ROOT, loadJSON
+from tnxqso.common import WEB_ROOT, web_json_response
 from tnxqso.db import DB, splice_params
 from tnxqso.services.auth import auth, BANLIST, SITE_ADMINS
 from tnxqso.services.station_dir import save_station_settings, get_station_path
+from tnxqso.services.file_writer import FILE_WRITER
+from tnxqso.services.file_io import FILE_IO, LOOP_LAG_MONITOR, load_json, save_json
+from tnxqso.services.media import MEDIA_PROCESSOR
+from tnxqso.services.http_cache import HTTP_CACHE
+from tnxqso.services.spatial_cache import WFS_CACHE
+from tnxqso.services.geo_layers import GEO_LAYERS
+from tnxqso.services.countries import COUNTRIES
+from tnxqso.services.qth_now import QTH_NOW
+from tnxqso.services.http_client import HTTP_CLIENT
 
 ADMIN_ROUTES = web.RouteTableDef()
 
@@ -20,16 +28,32 @@ async def suspicious_handler(_):
             where chat_callsign is not null and chat_callsign not in ('', upper(callsign))
             """))
 
+@ADMIN_ROUTES.post('/aiohttp/admin/stats')
+@auth(require_admin=True)
+async def stats_handler(_data, **_):
+    return web_json_response({
+        'db': DB.pool_stats(),
+        'io': FILE_IO.stats(),
+        'file_writer': FILE_WRITER.stats(),
+        'loop': LOOP_LAG_MONITOR.stats(),
+        'media': MEDIA_PROCESSOR.stats(),
+        'http_cache': HTTP_CACHE.stats(),
+        'wfs_cache': WFS_CACHE.stats(),
+        'geo_layers': GEO_LAYERS.stats(),
+        'countries': COUNTRIES.stats(),
+        'qth_now': QTH_NOW.stats(),
+        'http_client': HTTP_CLIENT.stats()
+        })
+
 @ADMIN_ROUTES.post('/aiohttp/publish')
 @auth(require_admin=True)
 async def publish_handler(data, **_):
     publish_path = WEB_ROOT + '/js/publish.json'
-    publish = loadJSON(publish_path) or {}
+    publish = (await load_json(publish_path)) or {}
     publish[data['station']] = data['publish']
-    with open(publish_path, 'w') as f_publish:
-        json.dump(publish, f_publish, ensure_ascii = False)
+    await save_json(publish_path, publish)
     station_path = get_station_path(data['station'])
-    station_settings = loadJSON(station_path + '/settings.json')
+    station_settings = await FILE_WRITER.load_json(station_path + '/settings.json')
     station_settings['publish'] = data['publish']['user']
     await save_station_settings(station_settings['admin'], station_settings)
     return web.Response(text = 'OK')
@@ -59,6 +83,9 @@ async def ban_user_handler(data, **_):
             'email': user_data['email'],
             'alts': user_data['alts']
             })
+    DB.invalidate_user_data(user_data['callsign'])
+    for alt in user_data['alts']:
+        DB.invalidate_user_data(alt)
     if data.get('unban'):
         if user_data['callsign'] in BANLIST['callsigns']:
             BANLIST['callsigns'].remove(user_data['callsign'])
@@ -77,8 +104,7 @@ async def ban_user_handler(data, **_):
                     BANLIST['callsigns'].append(alt)
         if user_data['email'] not in BANLIST['emails']:
             BANLIST['emails'].append(user_data['email'])
-    with open(WEB_ROOT + '/js/banlist.json', 'w') as f_bl:
-        json.dump(BANLIST, f_bl)
+    await save_json(WEB_ROOT + '/js/banlist.json', BANLIST)
     return web.Response(text='OK')
 
 @ADMIN_ROUTES.post('/aiohttp/users')
@@ -1,60 +1,81 @@
 #!/usr/bin/python3
 #coding=utf-8
 import os
-from ctypes import c_void_p, c_size_t
 import uuid
+from datetime import timezone
 
-import ffmpeg
-from wand.image import Image
-from wand.color import Color
-from wand.api import library
 from aiohttp import web
 
 from tnxqso.common import CONF
 from tnxqso.db import DB
-from tnxqso.services.auth import auth, extract_callsign, SITE_ADMINS
+from tnxqso.services.auth import auth, extract_callsign, SITE_ADMINS, UploadedFile
 from tnxqso.services.station_dir import (get_station_path_by_admin_cs, delete_blog_entry,
-    get_gallery_size)
-
-library.MagickSetCompressionQuality.argtypes = [c_void_p, c_size_t]
+    get_user_gallery_usage)
+from tnxqso.services.media import MEDIA_PROCESSOR
+from tnxqso.services.http_cache import HTTP_CACHE, http_cache
 
 BLOG_ROUTES = web.RouteTableDef()
 
+BLOG_PAGE_LENGTH = CONF.getint('web', 'blog_page_length', fallback=100)
+BLOG_PAGE_LENGTH_MAX = 1000
+
+DB.register_query('blog_page', """
+    select id, "file", file_type, file_thumb, variants, txt,
+        to_char(timestamp_created, 'DD Mon YYYY HH24:MI') as post_datetime,
+        extract(epoch from timestamp_created) as ts,
+        reactions, last_comment_id
+    from blog_entries
+    where "user" = %(callsign)s and not processing and
+        (%(before)s::bigint is null or id < %(before)s)
+    order by id desc
+    limit %(limit)s""")
+
+async def invalidate_blog_entry_cache(entry_id):
+    """drops the cached comments of the entry and the feed of its blog"""
+    entry = await DB.execute("""
+        select "user"
+        from blog_entries
+        where id = %(entryId)s""", {'entryId': entry_id})
+    HTTP_CACHE.invalidate(f"blog_comments:{entry_id}",
+            *([f"blog:{entry['user']}"] if entry else []))
+
 @BLOG_ROUTES.get('/aiohttp/blog/{callsign}')
+@http_cache('blog', lambda request: [f"blog:{extract_callsign(request)}"])
 async def get_blog_entries_handler(request):
+    """returns a page of the blog entries (newest first)
+    query params: limit, before - entry id to start the page after
+    X-Next-Before header holds the before param of the next page"""
     callsign = extract_callsign(request)
-    data = await DB.execute("""
-            select id, "file", file_type, file_thumb, txt, 
-                to_char(timestamp_created, 'DD Mon YYYY HH24:MI') as post_datetime,
-                extract(epoch from timestamp_created) as ts,
-                (select count(*) 
-                    from blog_reactions 
-                    where entry_id = blog_entries.id) as reactions,
-                (select blog_comments.id
-                    from blog_comments
-                    where entry_id = blog_entries.id
-                    order by blog_comments.id desc
-                    limit 1) as last_comment_id
-            from blog_entries
-            where "user" = %(callsign)s
-            order by id desc
-            """,
-            params={'callsign': callsign},
-            container='list')
-    if not data:
-        return web.HTTPNotFound(text='Blog entries not found')
-    last_modified = (await DB.execute("""
-        select to_char(greatest(
-            (select timestamp_created 
-            from blog_entries
-            where "user" = callsign
-            order by id desc limit 1), 
-            last_blog_entry_delete),
-            'DD Mon YYYY HH24:MI:SS') as last_modified
-            from users where callsign = %(callsign)s""",
-            {'callsign': callsign}))['last_modified']
-
-    return web.json_response(data, headers={'last-modified': last_modified})
+    user_data = await DB.execute("""
+        select blog_modified
+        from users
+        where callsign = %(callsign)s""",
+        {'callsign': callsign})
+    if not user_data:
+        raise web.HTTPNotFound(text='Blog entries not found')
+    last_modified = user_data['blog_modified']
+    if last_modified:
+        last_modified = last_modified.replace(tzinfo=timezone.utc, microsecond=0)
+        if request.if_modified_since and last_modified <= request.if_modified_since:
+            raise web.HTTPNotModified()
+    try:
+        limit = min(int(request.query.get('limit') or BLOG_PAGE_LENGTH), BLOG_PAGE_LENGTH_MAX)
+        before = int(request.query['before']) if request.query.get('before') else None
+    except ValueError:
+        raise web.HTTPBadRequest(text='Invalid page params')
+    data = await DB.execute_named('blog_page',
+            {'callsign': callsign, 'before': before, 'limit': limit},
+            container='list') or []
+    #a page after the last one (the entry count is a multiple of limit) is empty
+    if not data and not before:
+        raise web.HTTPNotFound(text='Blog entries not found')
+    headers = {}
+    if len(data) == limit:
+        headers['X-Next-Before'] = str(data[-1]['id'])
+    response = web.json_response(data, headers=headers)
+    if last_modified:
+        response.last_modified = last_modified
+    return response
 
 @BLOG_ROUTES.post('/aiohttp/blog/{callsign}/comments/read')
 @auth()
@@ -93,7 +114,7 @@ async def delete_blog_entry_handler(_data, *, callsign, request, **_):
     if not entry_id:
         raise web.HTTPBadRequest(text = 'No valid post id was specified.')
     entry_in_db = await DB.execute("""
-        select id, "file", file_thumb
+        select id, "user", "file", file_thumb, variants
         from blog_entries
         where id = %(entryId)s and (%(callsign)s is null or "user" = %(callsign)s)""",
         {'entryId': entry_id, 'callsign': callsign if callsign not in SITE_ADMINS else None})
@@ -101,13 +122,14 @@ async def delete_blog_entry_handler(_data, *, callsign, request, **_):
         return web.HTTPNotFound(text='Blog entry not found')
     station_path = await get_station_path_by_admin_cs(callsign)
     await delete_blog_entry(entry_in_db, station_path)
+    HTTP_CACHE.invalidate(f"blog:{entry_in_db['user']}", f"blog_comments:{entry_id}")
     return web.Response(text='OK')
 
 @BLOG_ROUTES.post('/aiohttp/blog/clear')
 @auth(require_email_confirmed=True)
 async def clear_blog_handler(_data, *, callsign, **_):
     entries_in_db = await DB.execute("""
-        select id, "file", file_thumb
+        select id, "file", file_thumb, variants
         from blog_entries
         where "user" = %(callsign)s""",
         {'callsign': callsign},
@@ -116,6 +138,8 @@ async def clear_blog_handler(_data, *, callsign, **_):
         station_path = await get_station_path_by_admin_cs(callsign)
         for entry in entries_in_db:
             await delete_blog_entry(entry, station_path)
+        HTTP_CACHE.invalidate(f"blog:{callsign}",
+                *(f"blog_comments:{entry['id']}" for entry in entries_in_db))
     return web.Response(text='OK')
 
 
@@ -126,7 +150,7 @@ async def delete_blog_comment_handler(_data, *, callsign, request, **_):
     if not comment_id:
         raise web.HTTPBadRequest(text = 'No valid comment id was specified.')
     comment_in_db = await DB.execute("""
-        select blog_comments.id 
+        select blog_comments.id, entry_id, blog_entries.user
         from blog_comments join blog_entries 
             on entry_id = blog_entries.id
         where blog_comments.id = %(commentId)s and 
@@ -139,6 +163,8 @@ async def delete_blog_comment_handler(_data, *, callsign, request, **_):
         delete from blog_comments 
         where id = %(commentId)s""",
         {'commentId': comment_id})
+    HTTP_CACHE.invalidate(f"blog:{comment_in_db['user']}",
+            f"blog_comments:{comment_in_db['entry_id']}")
     return web.Response(text='OK')
 
 @BLOG_ROUTES.post('/aiohttp/blog/{entry_id}/comments')
@@ -151,6 +177,7 @@ async def create_blog_comment_handler(data, *, callsign, request, **_):
         insert into blog_comments ("user", entry_id, txt)
         values (%(callsign)s, %(entryId)s, %(txt)s)""",
         {"callsign": callsign, "entryId": entry_id, "txt": data["text"]})
+    await invalidate_blog_entry_cache(entry_id)
     return web.Response(text="OK")
 
 @BLOG_ROUTES.post('/aiohttp/blog/{entry_id}/reactions/{type}')
@@ -182,6 +209,7 @@ async def create_blog_reaction_handler(data, *, callsign, request, **_):
         on CONFlict on constraint blog_reactions_pkey
             do update set "type" = %(type)s""",
         {"callsign": callsign, "entryId": entry_id, "type": data["type"]})
+    await invalidate_blog_entry_cache(entry_id)
     return web.Response(text="OK")
 
 @BLOG_ROUTES.delete('/aiohttp/blog/{entry_id}/reactions')
@@ -194,9 +222,12 @@ async def delete_blog_reaction_handler(_data, *, callsign, request, **_):
         delete from blog_reactions
         where entry_id = %(entryId)s and "user" = %(callsign)s""",
         {'entryId': entry_id, 'callsign': callsign})
+    await invalidate_blog_entry_cache(entry_id)
     return web.Response(text='OK')
 
 @BLOG_ROUTES.get('/aiohttp/blog/{entry_id}/comments')
+@http_cache('blog_comments',
+        lambda request: [f"blog_comments:{int(request.match_info['entry_id'])}"])
 async def get_blog_comments_handler(request):
     entry_id = int(request.match_info.get('entry_id', None))
     if not entry_id:
@@ -216,115 +247,64 @@ async def get_blog_comments_handler(request):
 
 @BLOG_ROUTES.post('/aiohttp/blog')
 @BLOG_ROUTES.post('/aiohttp/gallery')
-@auth(require_email_confirmed=True)
+@auth(require_email_confirmed=True, gallery_upload=True)
 async def create_blog_entry_handler(data, *, callsign, **_):
-    station_path = await get_station_path_by_admin_cs(callsign)
-    gallery_path = station_path + '/gallery'
-    file = file_type = file_thumb = None
+    file = file_type = None
     if 'file' in data:
         post_id = uuid.uuid4().hex
         if data['file']:
-            if not os.path.isdir(gallery_path):
-                os.mkdir(gallery_path)
-            file = data['file']['contents']
-            file_name_base = post_id
-            file_ext = data['file']['name'].rpartition('.')[2]
-            file_name = file_name_base + '.' + file_ext
+            if not isinstance(data['file'], UploadedFile):
+                raise web.HTTPBadRequest(text='File upload is expected.')
+            gallery_path = os.path.dirname(data['file'].path)
+            file_ext = data['file'].name.rpartition('.')[2]
+            file_name = post_id + '.' + file_ext
             file_type = 'image' if 'image'\
-                in data['file']['type'] else 'video'
-            file_path = gallery_path + '/' + file_name
-            with open(file_path, 'wb') as f_img:
-                f_img.write(file)
-            tn_src = file_path
-            if file_type == 'video':
-
-                tn_src = gallery_path + '/' + file_name_base + '.jpeg'
-                (
-                    ffmpeg
-                        .input(file_path)
-                        .output(tn_src, vframes=1, vf="thumbnail")
-                        .run()
-                )
-                video_props = ffmpeg.probe(file_path)
-                video_stream = [stream for stream in video_props['streams']
-                        if stream['codec_type'] == 'video'][0]
-                max_video_height = int(CONF['gallery']['max_video_height'])
-                if video_stream['height'] > max_video_height:
-                    tmp_file_path = f"{gallery_path}/{file_name_base}_tmp.{file_ext}"
-                    os.rename(file_path, tmp_file_path)
-                    (
-                        ffmpeg
-                            .output(
-                                ffmpeg
-                                    .input(tmp_file_path)
-                                    .video
-                                    .filter('scale', -2, max_video_height),
-                                 ffmpeg
-                                    .input(tmp_file_path)
-                                    .audio,
-                                file_path)
-                            .run()
-                    )
-                    os.unlink(tmp_file_path)
-
-            with Image(filename=tn_src) as img:
-                with Image(width=img.width, height=img.height,
-                        background=Color("#EEEEEE")) as bg_img:
-
-                    bg_img.composite(img, 0, 0)
-
-                    exif = {}
-                    exif.update((key[5:], val) for key, val in img.metadata.items() if
-                            key.startswith('exif:'))
-                    if 'Orientation' in exif:
-                        if exif['Orientation'] == '3':
-                            bg_img.rotate(180)
-                        elif exif['Orientation'] == '6':
-                            bg_img.rotate(90)
-                        elif exif['Orientation'] == '8':
-                            bg_img.rotate(270)
-
-                    size = img.width if img.width < img.height else img.height
-                    bg_img.crop(width=size, height=size, gravity='north')
-                    bg_img.resize(200, 200)
-                    bg_img.format = 'jpeg'
-                    bg_img.save(filename=f'{gallery_path}/{file_name_base}_thumb.jpeg')
-                    if file_type == 'image':
-                        max_height, max_width = (int(CONF['gallery']['max_height']),
-                                int(CONF['gallery']['max_width']))
-                        if img.width > max_width or img.height > max_height:
-                            coeff = min(max_width/img.width, max_height/img.height)
-                            img.resize(width=int(coeff*img.width), height=int(coeff*img.height))
-                            img.compression_quality = int(CONF['gallery']['quality'])
-                            img.save(filename=file_path)
-            if file_type == 'video':
-                os.unlink(tn_src)
-
+                in (data['file'].type or '') else 'video'
+            os.replace(data['file'].path, f'{gallery_path}/{file_name}')
             file = f'gallery/{file_name}'
-            file_thumb = f'gallery/{file_name_base}_thumb.jpeg'
 
-        await DB.execute("""
+        entry = await DB.execute("""
             insert into blog_entries
-                ("user", "file", file_type, file_thumb, txt)
+                ("user", "file", file_type, txt, processing, file_size)
             values
-                (%(callsign)s, %(file)s, %(fileType)s, %(fileThumb)s, %(text)s)
+                (%(callsign)s, %(file)s, %(fileType)s, %(text)s, %(processing)s,
+                %(fileSize)s)
+            returning id, "user", "file", file_type
             """,
             params={'callsign': callsign, 'file': file, 'fileType': file_type,
-                'fileThumb': file_thumb, 'text': data['caption']})
+                'text': data['caption'], 'processing': bool(file),
+                'fileSize': data['file'].size if file else 0})
+        if not entry:
+            raise web.HTTPInternalServerError(text='Blog entry was not created')
+        if file:
+            MEDIA_PROCESSOR.submit(entry)
+        else:
+            HTTP_CACHE.invalidate(f"blog:{callsign}")
 
-        return web.Response(text='OK')
+        return web.json_response({'id': entry['id'],
+            'status': 'processing' if file else 'ready'})
 
-async def get_user_gallery_quota(callsign):
-    user_coeff = (await DB.execute("""
-        select gallery_quotas
-        from users
-        where callsign = %(callsign)s""", {'callsign': callsign}))['gallery_quotas']
-    return int(CONF['gallery']['quota'])*user_coeff
+@BLOG_ROUTES.get('/aiohttp/blog/{entry_id}/status')
+async def get_blog_entry_status_handler(request):
+    entry_id = int(request.match_info.get('entry_id', None))
+    if not entry_id:
+        raise web.HTTPBadRequest(text='No valid post id was specified.')
+    entry = await DB.execute("""
+        select id, "file", file_thumb, variants, processing
+        from blog_entries
+        where id = %(entryId)s""",
+        {'entryId': entry_id})
+    if not entry:
+        raise web.HTTPNotFound(text='Blog entry not found')
+    return web.json_response({
+        'id': entry['id'],
+        'status': 'processing' if entry['processing'] else 'ready',
+        'file': entry['file'],
+        'file_thumb': entry['file_thumb'],
+        'variants': entry['variants']
+        })
 
 @BLOG_ROUTES.post('/aiohttp/blog/quota')
 @auth(require_email_confirmed=True)
 async def get_blog_quota_handler(_data, *, callsign, **_):
-    return web.json_response({
-        'quota': await get_user_gallery_quota(callsign),
-        'used': get_gallery_size(await get_station_path_by_admin_cs(callsign))
-        })
+    return web.json_response(await get_user_gallery_usage(callsign))
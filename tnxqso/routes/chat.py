@@ -1,16 +1,16 @@
 #!/usr/bin/python3
 #coding=utf-8
-import json
 import time
 
 from aiohttp import web
 
-from tnxqso.common import WEB_ROOT, loadJSON
-from tnxqso.db import DB
+from tnxqso.common import WEB_ROOT
 from tnxqso.services.auth import auth, SITE_ADMINS
 from tnxqso.services.station_dir import get_station_path, strip_callsign
 from tnxqso.services.chat import insert_chat_message
 from tnxqso.services.rabbitmq import rabbitmq_publish
+from tnxqso.services.chat_store import get_chat
+from tnxqso.services.file_writer import FILE_WRITER
 
 CHAT_ROUTES = web.RouteTableDef()
 
@@ -25,7 +25,7 @@ async def chat_delete_handler(data, *, callsign, request,**_):
     chat_path = None
     if station:
         station_path = get_station_path(data['station'])
-        station_settings = loadJSON(station_path + '/settings.json')
+        station_settings = await FILE_WRITER.load_json(station_path + '/settings.json')
         admins = set(admins)
         admins.update([x.lower() for x in\
             station_settings['chatAdmins'] + 
@@ -33,33 +33,29 @@ async def chat_delete_handler(data, *, callsign, request,**_):
         chat_path = station_path + '/chat.json'
     else:
         chat_path = WEB_ROOT + '/js/talks.json'
-    chat = []
+    chat = await get_chat(chat_path)
     if 'ts' in data:
-        chat = loadJSON(chat_path) or []
-        if not callsign in admins:
-            message = [ x for x in chat if x['ts'] == data['ts'] ]
-            if message:
-                message = message[0]
-            else:
-                return web.HTTPNotFound(text='Message not found')
-            if message['cs'] != callsign:
-                raise web.HTTPUnauthorized(text='You must be logged in as station or site admin ')
-        chat = [ x for x in chat if x['ts'] != data['ts'] ]
+        async with chat.lock:
+            if not callsign in admins:
+                message = chat.find(data['ts'])
+                if not message:
+                    return web.HTTPNotFound(text='Message not found')
+                if message['cs'] != callsign:
+                    raise web.HTTPUnauthorized(
+                        text='You must be logged in as station or site admin ')
+            chat.delete(data['ts'])
         await rabbitmq_publish(request.app['rabbitmq']['exchanges']['chats'],
                 key=strip_callsign(station) if station else 'talks',
                 message={'delete_item': {'item_ts': data['ts'], 'delete_ts': time.time()}})
     else:
         if not callsign in admins:
             raise web.HTTPUnauthorized(text='You must be logged in as station or site admin')
-        if data.get('keepPinned'):
-            chat = loadJSON(chat_path) or []
-            chat = [m for m in chat if m['admin'] and m['text'].startswith('***')]
+        async with chat.lock:
+            chat.clear(keep_pinned=data.get('keepPinned'))
         await rabbitmq_publish(request.app['rabbitmq']['exchanges']['chats'],
                 key=strip_callsign(station) if station else 'talks',
                 message={'reload': True})
 
-    with open(chat_path, 'w') as f_chat:
-        json.dump(chat, f_chat, ensure_ascii = False)
     return web.Response(text = 'OK')
 
 @CHAT_ROUTES.post('/aiohttp/chat')
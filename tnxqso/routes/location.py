@@ -1,9 +1,9 @@
 #!/usr/bin/python3
 #coding=utf-8
 
+import asyncio
 import math
 import time
-import json
 from datetime import datetime, timedelta
 import logging
 
@@ -14,7 +14,11 @@ from tnxqso.common import WEB_ROOT, loadJSON, appRoot, dtFmt
 from tnxqso.services.auth import auth
 from tnxqso.services.station_dir import read_station_file, write_station_file
 from tnxqso.services.countries import get_country
+from tnxqso.services.spatial_cache import WFS_CACHE
+from tnxqso.services.geo_layers import GEO_LAYERS
+from tnxqso.services.http_client import HTTP_CLIENT
 from tnxqso.services.chat import insert_chat_message
+from tnxqso.services.qth_now import QTH_NOW
 
 LOCATION_ROUTES = web.RouteTableDef()
 
@@ -38,6 +42,8 @@ WFS_PARAMS = {
         "kda": {"feature": "KDAX", "tag": "kda"}
 }
 
+WFS_TIMEOUT = httpx.Timeout(2, connect=0.4)
+
 QTH_PARAMS = loadJSON(WEB_ROOT + '/js/qthParams.json')
 def empty_qth_fields(country=None):
     tmplt = {'titles': [QTH_PARAMS['defaultTitle']]*QTH_PARAMS['fieldCount'],\
@@ -47,6 +53,9 @@ def empty_qth_fields(country=None):
             tmplt['titles'][idx] = QTH_PARAMS['countries'][country]['fields'][idx]
     return tmplt
 
+def qth_country(country):
+    return country if country in QTH_PARAMS['countries'] else 'RU'
+
 def sind(deg):
     return math.sin(math.radians(deg))
 
@@ -54,6 +63,15 @@ def cosd(deg):
     return math.cos(math.radians(deg))
 
 async def wfs_query(wfs_type, location, strict=False):
+    """resolved by the local layer index if the layer is loaded,
+    wfs results are cached by the 8 char locator of the location"""
+    result = GEO_LAYERS.lookup(wfs_type, location, strict=strict)
+    if result:
+        return result
+    cache_key = f"{wfs_type}:{'intersects' if strict else 'dwithin'}:{''.join(locator(location))}"
+    result = WFS_CACHE.get(cache_key)
+    if result is not None:
+        return list(result)
     params = WFS_PARAMS[wfs_type]
     url = ('https://map.r1cf.ru/geoserver/cite/wfs?SERVICE=WFS&REQUEST=GetFeature&TypeName=' +
         '{feature}&VERSION=1.1.0&CQL_FILTER={predi}%28geom,POINT%28{lat}%20{lng}%29' +
@@ -66,10 +84,8 @@ async def wfs_query(wfs_type, location, strict=False):
         'addParams': '' if strict else ',0.25,kilometers' # ~250 meters
        }
     try:
-        data = ''
-        async with httpx.AsyncClient() as client:
-            rsp = await client.get(url.format_map(url_params), timeout=(0.4, 2))
-            data = rsp.text
+        rsp = await HTTP_CLIENT.get(url.format_map(url_params), timeout=WFS_TIMEOUT)
+        data = rsp.text
         tag = '<cite:' + params['tag'] + '>'
         result = []
         while tag in data:
@@ -77,29 +93,33 @@ async def wfs_query(wfs_type, location, strict=False):
             end = data.find('<', start)
             result.append(data[start:end])
             data = data[end:]
-        if not result:
+        if result:
+            WFS_CACHE.put(cache_key, result)
+        else:
             logging.error('invalid wfs response: %s', data)
-        return result
+        return list(result)
 
     except httpx.TimeoutException:
         logging.exception('wfs query timeout: ')
         return None
+    except httpx.HTTPError:
+        logging.exception('wfs query error: ')
+        return None
 
 async def get_qth_data(location, country=None):
+    """returns the qth data and the rda containing the location (or None)"""
 
-    if not country:
-        country = get_country(location)
-    if country not in QTH_PARAMS['countries']:
-        country = 'RU'
+    country = qth_country(country or await get_country(location))
 
     data = {'fields': empty_qth_fields(country)}
     data['loc'], data['loc8'] = locator(location)
+    strict_rda = None
 
     if country == 'RU':
 
         rda = '-----'
-        all_rda = await wfs_query('rda', location)
-        strict_rda = await wfs_query('rda', location, strict=True)
+        all_rda, strict_rda = await asyncio.gather(wfs_query('rda', location),
+                wfs_query('rda', location, strict=True))
         if all_rda:
             if strict_rda:
                 all_rda.sort(key=lambda item: item != strict_rda[0])
@@ -114,8 +134,8 @@ async def get_qth_data(location, country=None):
     elif country == 'KZ':
 
         kda = '-----'
-        all_kda = await wfs_query('kda', location)
-        strict_kda = await wfs_query('kda', location, strict=True)
+        all_kda, strict_kda = await asyncio.gather(wfs_query('kda', location),
+                wfs_query('kda', location, strict=True))
         if all_kda:
             if len(all_kda) > 1:
                 all_kda = [strict_kda] + [x for x in all_kda if x != strict_kda or x == '-----']
@@ -133,26 +153,31 @@ async def get_qth_data(location, country=None):
     if data['fields']['values'][0] == '-----':
         logging.error('wfs query failed, location %s, country %s', location, country)
 
-    return data
+    return data, strict_rda[0] if strict_rda else None
 
-def save_qth_now_location(callsign, location, path):
-    qth_now_locations = loadJSON(path) or []
-    _ts = int(time.time())
-    dt_utc = datetime.utcnow()
-    _dt, _tm = dtFmt(dt_utc)
-    qth_now_locations = [item for item in qth_now_locations
-            if _ts - item['ts'] < 600 and (item['location'][0] != location[0] or
-            item['location'][1] != location[1]) and
-            (callsign is None or item['callsign'] != callsign)]
-    qth_now_locations.append({
-        'location': location,
-        'ts': _ts,
-        'date': _dt,
-        'time': _tm,
-        'callsign': callsign
-    })
-    with open(path, 'w') as f_loc:
-        json.dump(qth_now_locations, f_loc, ensure_ascii = False)
+async def get_qth_now_data(location, country, qth_now):
+    """qth data of the location, the location is added to the qth now history
+    with the rda found (if any) even if the lookup fails
+    qth_now - (callsign, ts) of the qth now update or None"""
+    strict_rda = None
+    try:
+        data, strict_rda = await get_qth_data(location, country=country)
+        return data
+    finally:
+        if qth_now:
+            QTH_NOW.add_history(qth_now[0], location, strict_rda, qth_now[1])
+
+@LOCATION_ROUTES.get('/aiohttp/qth_now')
+async def get_qth_now_handler(request):
+    """current qth now locations within the bounding box
+    query params: bbox - min_lat,min_lng,max_lat,max_lng; all - include locations without callsign"""
+    try:
+        min_lat, min_lng, max_lat, max_lng = (float(coord) for coord in
+            request.query['bbox'].split(','))
+    except (KeyError, ValueError):
+        raise web.HTTPBadRequest(text='Invalid bbox')
+    return web.json_response(QTH_NOW.query(min_lat, min_lng, max_lat, max_lng,
+        callsigns_only=not request.query.get('all')))
 
 @LOCATION_ROUTES.post('/aiohttp/location')
 @auth(require_token=False)
@@ -174,6 +199,7 @@ async def location_handler(data, *, callsign, request, **_):
                     act_period[0] <= datetime.utcnow() <= act_period[1] + timedelta(days=1)):
                 station_callsign = station_settings['station']['callsign']
 
+    qth_now = None
     if new_data.get('location'):
         qth_now_cs = None
         if 'callsign' in new_data and new_data['callsign']:
@@ -183,14 +209,11 @@ async def location_handler(data, *, callsign, request, **_):
 
         if qth_now_cs:
             qth_now_cs = qth_now_cs.upper()
-            save_qth_now_location(qth_now_cs, new_data['location'],
-                    WEB_ROOT + '/js/qth_now_locations.json')
 
-        save_qth_now_location(qth_now_cs, new_data['location'],
-                WEB_ROOT + '/js/qth_now_locations_all.json')
+        qth_now = (qth_now_cs, QTH_NOW.update(qth_now_cs, new_data['location']))
 
     if not callsign and 'location' in new_data:
-        qth = await get_qth_data(new_data['location'])
+        qth = await get_qth_now_data(new_data['location'], None, qth_now)
         return web.json_response({'qth': qth})
     data = (await read_station_file(callsign, 'status.json')) or {}
     if 'locTs' not in data and 'ts' in data:
@@ -215,9 +238,9 @@ async def location_handler(data, *, callsign, request, **_):
     if new_data.get('location'):
         location = new_data['location']
 
-        country = get_country(location)
+        country = await get_country(location)
 
-        data['qth'] = await get_qth_data(location, country=country)
+        data['qth'] = await get_qth_now_data(location, country, qth_now)
 
         if 'comments' in new_data:
             data['comments'] = new_data['comments']
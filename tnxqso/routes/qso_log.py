@@ -3,18 +3,25 @@
 import time
 import json
 import logging
+import math
+import uuid
+from collections import defaultdict
 from datetime import datetime, timedelta
 import os
-from decimal import Decimal
+import shutil
+from decimal import Decimal, InvalidOperation
 from pathlib import Path
 
 from aiohttp import web
 
-from tnxqso.common import CONF, dtFmt, loadJSON, tzOffset
+from tnxqso.common import CONF, dtFmt, tzOffset
 from tnxqso.db import DB
-from tnxqso.services.auth import auth, extract_callsign
-from tnxqso.services.station_dir import (get_station_path_by_admin_cs,
+from tnxqso.services.auth import auth, extract_callsign, UploadedFile
+from tnxqso.services.station_dir import (get_station_path, get_station_path_by_admin_cs,
         read_station_file, write_station_file)
+from tnxqso.services.file_writer import FILE_WRITER
+from tnxqso.services.file_io import FILE_IO
+from tnxqso.services.http_cache import HTTP_CACHE
 
 QSO_LOG_ROUTES = web.RouteTableDef()
 
@@ -24,49 +31,288 @@ BANDS_WL = {'1.8': '160M', '3.5': '80M', '7': '40M',
 
 ADIF_QTH_FIELDS = ('MY_CNTY', 'MY_CITY', 'NOTES')
 
+ADIF_BANDS = {adif_band: band for band, adif_band in BANDS_WL.items()}
+
+ADIF_READ_CHUNK = 64 * 1024
+
+#qso fields stored in typed columns of the log table
+LOG_QSO_COLUMNS = (('ts', 'float'), ('qso_ts', 'float'), ('cs', 'varchar'),
+    ('band', 'varchar'), ('mode', 'varchar'), ('freq', 'numeric'))
+LOG_QSO_COLUMNS_LIST = ', '.join(column for column, _ in LOG_QSO_COLUMNS)
+
+#changes on every log update; an adif export started before the change is not cached
+ADIF_CACHE_GENERATION = defaultdict(int)
+
+LOG_SEARCH_PAGE_LENGTH = CONF.getint('web', 'log_search_page_length', fallback=100)
+LOG_SEARCH_PAGE_LENGTH_MAX = 1000
+
+#max rows in one multi-row db statement
+QSO_BATCH_SIZE = 500
+
+#fields which are not compared when looking for a duplicate of an uploaded qso
+QSO_IDENTITY_IGNORED_FIELDS = frozenset(('ts', 'rda', 'wff', 'comments',
+    'serverTs', 'qso_ts', 'qth', 'no', 'sound'))
+
+DB.register_query('log_page', """
+    select id, qso from log
+    where callsign = %(cs)s order by id desc
+    limit %(limit)s""")
+
+DB.register_query('log_delete_qso', """
+    delete from log
+    where callsign = %(callsign)s and ts = %(ts)s""")
+
+def adif_field(name, data):
+    data_str = str(data) if data else ''
+    return f"<{name.upper()}:{len(data_str)}>{data_str} "
+
+def adif_header():
+    return ("""ADIF Export from TNXLOG
+    Logs generated @ """ + time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()) + "\n<EOH>\n")
+
+def adif_record(qso):
+    record = ''
+    try:
+        qso_time = time.gmtime(qso['qso_ts'])
+        record = (
+                adif_field("CALL", qso['cs']) +
+                adif_field("QSO_DATE", time.strftime("%Y%m%d", qso_time)) +
+                adif_field("TIME_OFF", time.strftime("%H%M%S", qso_time)) +
+                adif_field("TIME_ON", time.strftime("%H%M%S", qso_time)) +
+                adif_field("BAND", BANDS_WL[qso['band']]) +
+                adif_field("STATION_CALLSIGN", qso['myCS']) +
+                adif_field("FREQ", str(Decimal(qso['freq'])/1000)) +
+                adif_field("MODE", qso['mode']) +
+                adif_field("RST_RCVD", qso['rcv']) +
+                adif_field("RST_SENT", qso['snt']) +
+                adif_field("MY_GRIDSQUARE", qso['loc']) +
+                adif_field("GRIDSQUARE", qso['loc_rcv'] if 'loc_rcv' in qso else None))
+    except Exception:
+        logging.exception('Error while adif conversion. QSO:')
+        logging.error(qso)
+
+    for field_no, val in enumerate(qso.get('qth') or []):
+        record += adif_field(ADIF_QTH_FIELDS[field_no], val)
+    return record + "<EOR>\r\n"
+
+async def adif_cache_path(callsign):
+    """path of the pre-rendered adif export of the station or None if there is no station"""
+    user_data = await DB.get_user_data(callsign)
+    station_cs = (user_data and
+        ((user_data.get('settings') or {}).get('station') or {}).get('callsign'))
+    if not station_cs:
+        return None
+    station_path = get_station_path(station_cs)
+    if not await FILE_IO.run(os.path.isdir, station_path):
+        return None
+    return f"{station_path}/log.adi"
+
+def remove_file(file_path):
+    if os.path.isfile(file_path):
+        os.unlink(file_path)
+
+def file_stat(file_path):
+    try:
+        return os.stat(file_path)
+    except FileNotFoundError:
+        return None
+
+async def invalidate_adif_cache(callsign, cache_path):
+    """the export is newest first, so any change of the log drops the cache
+    which is rendered again by the next export"""
+    ADIF_CACHE_GENERATION[callsign] += 1
+    if cache_path:
+        await FILE_IO.run(remove_file, cache_path)
+
 @QSO_LOG_ROUTES.get('/aiohttp/adif/{callsign}')
 async def export_adif_handler(request):
     callsign = extract_callsign(request)
-    log = await log_from_db(callsign, limit=False)
+    headers = {
+        'Content-Disposition':
+            f'Attachment;filename={callsign + datetime.now().strftime("_%d_%b_%Y")}.adi'
+        }
+    cache_path = await adif_cache_path(callsign)
 
-    adif = """ADIF Export from TNXLOG
-    Logs generated @ """ + time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()) + "\n<EOH>\n"
+    cache_stat = (await FILE_IO.run(file_stat, cache_path)) if cache_path else None
+    if cache_stat:
+        etag = f"{cache_stat.st_mtime_ns:x}-{cache_stat.st_size:x}"
+        if_modified_since = request.if_modified_since
+        if (f'"{etag}"' in request.headers.get('If-None-Match', '') or
+                (if_modified_since and
+                    int(cache_stat.st_mtime) <= if_modified_since.timestamp())):
+            HTTP_CACHE.count('adif', 'not_modified')
+            raise web.HTTPNotModified(headers={'ETag': f'"{etag}"'})
+        HTTP_CACHE.count('adif', 'hits')
+        headers['ETag'] = f'"{etag}"'
+        response = web.FileResponse(cache_path, headers=headers)
+        response.content_type = 'application/octet-stream'
+        return response
 
-    def adif_field(name, data):
-        data_str = str(data) if data else ''
-        return f"<{name.upper()}:{len(data_str)}>{data_str} "
+    HTTP_CACHE.count('adif', 'misses')
+    response = web.StreamResponse(headers=headers)
+    response.content_type = 'application/octet-stream'
+    #gzip is used if the client accepts it
+    response.enable_compression()
+    await response.prepare(request)
 
-    for qso in log:
+    #the export is saved as the station adif cache unless the log was changed meanwhile
+    generation = ADIF_CACHE_GENERATION[callsign]
+    tmp_path = f"{cache_path}.{uuid.uuid4().hex}.tmp" if cache_path else None
+    f_cache = (await FILE_IO.run(open, tmp_path, 'w')) if tmp_path else None
+    try:
+        async def write(chunk):
+            await response.write(chunk.encode())
+            if f_cache:
+                await FILE_IO.run(f_cache.write, chunk)
+
+        await write(adif_header())
+        #the stream is closed explicitly, so the db connection is released
+        #as soon as the client disconnects
+        #DBError is not caught: the response is aborted without eof
+        #and the partial export is not saved as the cache
+        stream = DB.stream("""
+                select qso from log
+                where callsign = %(cs)s order by id desc""", {'cs': callsign})
         try:
-            qso_time = time.gmtime(qso['qso_ts'])
-            adif += (
-                    adif_field("CALL", qso['cs']) +
-                    adif_field("QSO_DATE", time.strftime("%Y%m%d", qso_time)) +
-                    adif_field("TIME_OFF", time.strftime("%H%M%S", qso_time)) +
-                    adif_field("TIME_ON", time.strftime("%H%M%S", qso_time)) +
-                    adif_field("BAND", BANDS_WL[qso['band']]) +
-                    adif_field("STATION_CALLSIGN", qso['myCS']) +
-                    adif_field("FREQ", str(Decimal(qso['freq'])/1000)) +
-                    adif_field("MODE", qso['mode']) +
-                    adif_field("RST_RCVD", qso['rcv']) +
-                    adif_field("RST_SENT", qso['snt']) +
-                    adif_field("MY_GRIDSQUARE", qso['loc']) +
-                    adif_field("GRIDSQUARE", qso['loc_rcv'] if 'loc_rcv' in qso else None))
-        except Exception:
-            logging.exception('Error while adif conversion. QSO:')
-            logging.error(qso)
-
-        for field_no, val in enumerate(qso['qth']):
-            adif += adif_field(ADIF_QTH_FIELDS[field_no], val)
-        adif += "<EOR>\r\n"
-
-    return web.Response(
-            headers={
-                'Content-Disposition':
-                    f'Attachment;filename={callsign + datetime.now().strftime("_%d_%b_%Y")}.adi'
-            },
-            body=adif.encode()
-        )
+            async for rows in stream:
+                await write(''.join(adif_record(row['qso']) for row in rows))
+        finally:
+            await stream.aclose()
+        await response.write_eof()
+        if f_cache:
+            await FILE_IO.run(f_cache.close)
+            if generation == ADIF_CACHE_GENERATION[callsign]:
+                await FILE_IO.run(os.replace, tmp_path, cache_path)
+    finally:
+        if f_cache:
+            await FILE_IO.run(f_cache.close)
+            await FILE_IO.run(remove_file, tmp_path)
+    return response
+
+class AdifReader:
+    """incremental adif (.adi) parser
+    feed() takes text chunks and returns the records completed so far
+    as dicts of uppercase field names"""
+
+    def __init__(self):
+        self.buffer = ''
+        #None - not known yet, True - inside the header, False - reading records
+        self.header = None
+        self.record = {}
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        records = []
+        if self.header is None:
+            text = self.buffer.lstrip()
+            if not text:
+                return records
+            #no header if the file starts with a field
+            self.header = not text.startswith('<')
+        pos = 0
+        while True:
+            tag_start = self.buffer.find('<', pos)
+            if tag_start == -1:
+                pos = len(self.buffer)
+                break
+            tag_end = self.buffer.find('>', tag_start)
+            if tag_end == -1:
+                pos = tag_start
+                break
+            tag = self.buffer[tag_start + 1:tag_end].split(':')
+            name = tag[0].strip().upper()
+            if name in ('EOH', 'EOR'):
+                if name == 'EOR' and self.record and not self.header:
+                    records.append(self.record)
+                self.header = False
+                self.record = {}
+                pos = tag_end + 1
+                continue
+            try:
+                length = int(tag[1]) if len(tag) > 1 else 0
+            except ValueError:
+                length = 0
+            if tag_end + 1 + length > len(self.buffer):
+                pos = tag_start
+                break
+            if not self.header:
+                self.record[name] = self.buffer[tag_end + 1:tag_end + 1 + length]
+            pos = tag_end + 1 + length
+        self.buffer = self.buffer[pos:]
+        return records
+
+def adif_to_qso(record):
+    """converts adif record to the qso dict format of log_handler
+    adif text is read as latin-1 (field lengths are in bytes) and decoded as utf-8 here
+    returns None if the record lacks required fields"""
+    record = {key: val.encode('latin-1').decode('utf-8', errors='replace').strip()
+        for key, val in record.items()}
+    try:
+        qso_time = record['TIME_ON'].ljust(6, '0')
+        qso_date = record['QSO_DATE']
+        freq = (str(Decimal(record['FREQ']) * 1000) if record.get('FREQ')
+            else None)
+        return {
+            'ts': f"{qso_date[:4]}-{qso_date[4:6]}-{qso_date[6:8]} " +
+                f"{qso_time[:2]}:{qso_time[2:4]}:{qso_time[4:6]}",
+            'cs': record['CALL'].upper(),
+            'band': ADIF_BANDS[record['BAND'].upper()],
+            'freq': freq,
+            'mode': record.get('MODE'),
+            'myCS': (record.get('STATION_CALLSIGN') or record.get('OPERATOR') or '').upper(),
+            'snt': record.get('RST_SENT'),
+            'rcv': record.get('RST_RCVD'),
+            'loc': record.get('MY_GRIDSQUARE'),
+            'loc_rcv': record.get('GRIDSQUARE'),
+            'comments': record.get('COMMENT', ''),
+            'qth': [record.get(field, '') for field in ADIF_QTH_FIELDS],
+            'sound': None
+            }
+    except (KeyError, InvalidOperation):
+        return None
+
+@QSO_LOG_ROUTES.post('/aiohttp/adif')
+@auth(require_email_confirmed=True)
+async def import_adif_handler(data, *, callsign, **_):
+    if not isinstance(data.get('file'), UploadedFile):
+        raise web.HTTPBadRequest(text='ADIF file is missing')
+    log = await read_station_file(callsign, 'log.json')
+    if log is False:
+        log = (await log_from_db(callsign)) or []
+    cache_path = await adif_cache_path(callsign)
+    report = {'inserted': 0, 'duplicates': 0, 'invalid': 0}
+
+    async def import_batch(qsos):
+        processed, _, db_inserts = merge_qsos(log, qsos)
+        report['invalid'] += processed.count(None)
+        inserted = (await db_insert_qsos(callsign, db_inserts)) if db_inserts else []
+        drop_not_inserted(log, db_inserts, inserted)
+        report['inserted'] += len(inserted)
+        report['duplicates'] += len(qsos) - processed.count(None) - len(inserted)
+        if inserted:
+            await invalidate_adif_cache(callsign, cache_path)
+
+    reader = AdifReader()
+    batch = []
+    with open(data['file'].path, 'rb') as f_adif:
+        while True:
+            chunk = await FILE_IO.run(f_adif.read, ADIF_READ_CHUNK)
+            if not chunk:
+                break
+            for record in reader.feed(chunk.decode('latin-1')):
+                qso = adif_to_qso(record)
+                if qso:
+                    batch.append(qso)
+                else:
+                    report['invalid'] += 1
+                if len(batch) == QSO_BATCH_SIZE:
+                    await import_batch(batch)
+                    batch = []
+    if batch:
+        await import_batch(batch)
+
+    await write_log_page(callsign, log)
+    return web.json_response(report)
 
 @QSO_LOG_ROUTES.post('/aiohttp/soundRecord')
 @auth(require_email_confirmed=True)
@@ -75,28 +321,24 @@ async def sound_record_handler(data, *, callsign, **_):
     sound_records_path = station_path + '/sound'
     if not os.path.isdir(sound_records_path):
         os.mkdir(sound_records_path)
-    file = data['file']['contents']
-    file_name = data['file']['name']
+    if not isinstance(data.get('file'), UploadedFile):
+        raise web.HTTPBadRequest(text='Sound record file is missing')
+    file_name = os.path.basename(data['file'].name)
     file_path = sound_records_path + '/' + file_name
-    with open(file_path, 'wb') as f_sound:
-        f_sound.write(file)
+    await FILE_IO.run(shutil.move, data['file'].path, file_path)
     sound_records_data_path = station_path + '/sound.json'
-    sound_records_data = loadJSON(sound_records_data_path)
+    sound_records_data = await FILE_WRITER.load_json(sound_records_data_path)
     if not sound_records_data:
         sound_records_data = []
     sound_records_data.append(file_name)
-    with open(sound_records_data_path, 'w') as f_sr_data:
-        json.dump(sound_records_data, f_sr_data, ensure_ascii = False)
+    FILE_WRITER.write(sound_records_data_path,
+            json.dumps(sound_records_data, ensure_ascii=False))
     return web.Response(text='oK')
 
-async def log_from_db(callsign, limit=True):
+async def log_from_db(callsign):
     log = []
-    limit_clause = f" limit{CONF['web'].getint('log_page_length')}" if limit else ''
-    data = await DB.execute(
-        f"""select id, qso from log
-            where callsign = %(cs)s order by id desc
-            {limit_clause}
-        """, {'cs': callsign})
+    data = await DB.execute_named('log_page',
+        {'cs': callsign, 'limit': CONF['web'].getint('log_page_length')})
     if data:
         if isinstance(data, dict):
             log.append(data['qso'])
@@ -104,22 +346,183 @@ async def log_from_db(callsign, limit=True):
             log = [row['qso'] for row in data]
     return log
 
-async def db_insert_qso(callsign, qso):
-    insert_success = await DB.execute("""
-        insert into log (callsign, qso) 
-        values (%(callsign)s, %(qso)s)""",
-        {'callsign': callsign, 'qso': json.dumps(qso)})
-    if not insert_success:
-        qso_in_db = await DB.execute("""
-            select qso from log
-            where callsign = %(callsign)s and (qso->>'cs') = %(cs)s and 
-                (qso->>'qso_ts') = %(qso_ts)s and (qso->>'band') = %(band)s""",
-            {'callsign': callsign,
-                'qso_ts': str(qso['qso_ts']),
-                'cs': qso['cs'],
-                'band': qso['band']})
-        if qso_in_db:
-            return qso_in_db.get('ts')
+def qso_freq(qso):
+    try:
+        freq = Decimal(str(qso.get('freq')))
+    except InvalidOperation:
+        return None
+    return freq if freq.is_finite() else None
+
+def qso_columns(qso):
+    """values of the log table qso columns"""
+    return {
+        'ts': qso['ts'],
+        'qso_ts': qso['qso_ts'],
+        'cs': str(qso['cs']),
+        'band': str(qso['band']),
+        'mode': qso.get('mode'),
+        'freq': qso_freq(qso)
+        }
+
+def qso_db_key(qso):
+    """values of the log_callsign_cs_qso_ts_band_uq index columns"""
+    return (str(qso['cs']), qso['qso_ts'], str(qso['band']))
+
+def qso_values(qso, idx, params):
+    """adds qso column values to the params of a multi-row statement
+    returns the row values clause"""
+    params.update({f"{column}_{idx}": val for column, val in qso_columns(qso).items()})
+    params[f"qso_{idx}"] = json.dumps(qso)
+    return ("(" + ", ".join(f"%({column}_{idx})s::{col_type}"
+        for column, col_type in LOG_QSO_COLUMNS) + f", %(qso_{idx})s::jsonb)")
+
+async def db_update_qsos(callsign, qsos):
+    """updates qsos by their ts with a single query
+    returns the qsos which were not found in db"""
+    params = {'callsign': callsign}
+    values = [qso_values(qso, idx, params) for idx, qso in enumerate(qsos)]
+    db_data = await DB.execute(f"""
+        update log set qso = batch.qso, qso_ts = batch.qso_ts, cs = batch.cs,
+            band = batch.band, mode = batch.mode, freq = batch.freq
+        from (values {', '.join(values)}) as batch ({LOG_QSO_COLUMNS_LIST}, qso)
+        where callsign = %(callsign)s and log.ts = batch.ts
+        returning batch.ts""", params, container='list') or []
+    updated = {row['ts'] for row in db_data}
+    return [qso for qso in qsos if qso['ts'] not in updated]
+
+async def db_insert_qsos(callsign, qsos):
+    """inserts qsos with a single multi-row upsert on log_callsign_cs_qso_ts_band_uq
+    qsos which are already in db get the ts of the stored qso
+    returns the qsos which were actually inserted"""
+    batch = {}
+    for qso in qsos:
+        batch.setdefault(qso_db_key(qso), qso)
+    params = {'callsign': callsign}
+    values = ["(%(callsign)s, " + qso_values(qso, idx, params)[1:]
+        for idx, qso in enumerate(batch.values())]
+    db_data = await DB.execute(f"""
+        insert into log (callsign, {LOG_QSO_COLUMNS_LIST}, qso)
+        values {', '.join(values)}
+        on conflict (callsign, cs, qso_ts, band)
+            do update set qso = log.qso
+        returning cs, qso_ts, band, ts""", params, container='list') or []
+    db_ts = {(row['cs'], row['qso_ts'], row['band']): row['ts'] for row in db_data}
+    inserted = [qso for key, qso in batch.items() if db_ts.get(key) == qso['ts']]
+    for qso in qsos:
+        prev_ts = db_ts.get(qso_db_key(qso))
+        if prev_ts is not None:
+            qso['ts'] = prev_ts
+    return inserted
+
+def drop_not_inserted(log, qsos, inserted):
+    """removes from the cached log (in place) the qsos merged as new ones
+    which db_insert_qsos found already stored (by cs, qso_ts, band)"""
+    inserted_ids = {id(qso) for qso in inserted}
+    dropped_ids = {id(qso) for qso in qsos if id(qso) not in inserted_ids}
+    if dropped_ids:
+        log[:] = [qso for qso in log if id(qso) not in dropped_ids]
+
+def parse_qso_ts(qso):
+    """sets qso date/time fields from the logger timestamp
+    returns qso datetime or None if the timestamp is invalid"""
+    try:
+        dtime = datetime.strptime(qso['ts'], "%Y-%m-%d %H:%M:%S")
+        qso['date'], qso['time'] = dtFmt(dtime)
+        qso['qso_ts'] = (dtime - datetime(1970, 1, 1)) / timedelta(seconds=1)
+    except (ValueError, TypeError) as exc:
+        logging.error("Error parsing qso timestamp %s", qso['ts'])
+        logging.exception(exc)
+        return None
+    return dtime
+
+def qso_identity(qso):
+    """hashable key of the qso fields which identify a qso sent by the logger"""
+    return json.dumps({key: val for key, val in qso.items()
+        if key not in QSO_IDENTITY_IGNORED_FIELDS}, sort_keys=True, default=str)
+
+def merge_qsos(log, qsos):
+    """merges qsos into the cached log list (in place)
+    duplicates and updated qsos are looked up in hash indexes by ts and by identity
+    returns a tuple of lists: processed qsos (None for invalid ones),
+    qsos to update in db, new qsos to insert in db"""
+    by_ts = {log_qso['ts']: log_qso for log_qso in log}
+    by_identity = {qso_identity(log_qso): log_qso for log_qso in log}
+    processed = []
+    db_updates = []
+    db_inserts = []
+
+    for qso in qsos:
+        if not parse_qso_ts(qso):
+            processed.append(None)
+            continue
+
+        server_ts = qso.pop('serverTs') if 'serverTs' in qso else None
+
+        if server_ts:
+            qso['ts'] = server_ts
+            by_ts[qso['ts']] = qso
+            db_updates.append(qso)
+
+        else:
+            identity = qso_identity(qso)
+            log_qso = by_identity.get(identity)
+            #the indexed qso could have been replaced by a serverTs update
+            if log_qso and by_ts.get(log_qso['ts']) is log_qso:
+                logging.debug('prev qso found:')
+                qso['ts'] = log_qso['ts']
+                log_qso['qso_ts'] = qso['qso_ts']
+            else:
+                qso['ts'] = time.time()
+                #a fixed small increment is below float precision of current timestamps
+                while qso['ts'] in by_ts:
+                    qso['ts'] = math.nextafter(qso['ts'], math.inf)
+                by_ts[qso['ts']] = qso
+                db_inserts.append(qso)
+            by_identity[identity] = by_ts[qso['ts']]
+
+        processed.append(qso)
+
+    log[:] = by_ts.values()
+    return processed, db_updates, db_inserts
+
+async def process_qsos(callsign, log, qsos):
+    """merges qsos into the cached log (in place) and writes them to db in batches
+    returns the list of qso ts (None for invalid qsos) in the order of qsos"""
+    processed, db_updates, db_inserts = merge_qsos(log, qsos)
+    status_qso = max(db_inserts, key=lambda qso: qso['qso_ts'], default=None)
+
+    for idx in range(0, len(db_updates), QSO_BATCH_SIZE):
+        db_inserts += await db_update_qsos(callsign, db_updates[idx:idx + QSO_BATCH_SIZE])
+    inserted = []
+    for idx in range(0, len(db_inserts), QSO_BATCH_SIZE):
+        inserted += await db_insert_qsos(callsign, db_inserts[idx:idx + QSO_BATCH_SIZE])
+    drop_not_inserted(log, db_inserts, inserted)
+
+    cache_path = await adif_cache_path(callsign)
+    if db_updates or inserted:
+        await invalidate_adif_cache(callsign, cache_path)
+
+    if status_qso:
+        status_data = await read_station_file(callsign, 'status.json')
+        _ts = datetime.utcfromtimestamp(status_qso['qso_ts']).timestamp() + tzOffset()
+        status_update = False
+        if ('freq' not in status_data or status_data['freq']['ts'] < _ts):
+            status_data['freq'] = {'value': status_qso['freq'], 'ts': _ts}
+            status_update = True
+        if ('callsign' not in status_data or status_data['callsign']['ts'] < _ts):
+            status_data['callsign'] = {'value': status_qso['myCS'], 'ts': _ts}
+            status_update = True
+        if status_update:
+            await write_station_file(callsign, 'status.json', status_data)
+
+    return [qso['ts'] if qso else None for qso in processed]
+
+async def write_log_page(callsign, log):
+    log = sorted(log, key=lambda qso: qso['qso_ts'] if 'qso_ts' in qso else qso['ts']/10,
+            reverse=True)
+    log = log[:CONF['web'].getint('log_page_length')]
+    logging.debug(log)
+    await write_station_file(callsign, 'log.json', log)
 
 @QSO_LOG_ROUTES.post('/aiohttp/log')
 @auth(require_email_confirmed=True)
@@ -130,100 +533,22 @@ async def log_handler(data, *, callsign, **_):
 
     if 'qso' in data:
 
-        rsp = []
-
-        async def process_qso(qso):
-            try:
-                dtime = datetime.strptime(qso['ts'], "%Y-%m-%d %H:%M:%S")
-                qso['date'], qso['time'] = dtFmt(dtime)
-                qso['qso_ts'] = (dtime - datetime(1970, 1, 1)) / timedelta(seconds=1)
-            except (ValueError, TypeError) as exc:
-                logging.error("Error parsing qso timestamp %s", qso['ts'])
-                logging.exception(exc)
-                return {'ts': None}
-
-            server_ts = qso.pop('serverTs') if 'serverTs' in qso else None
-
-            if server_ts:
-                qso['ts'] = server_ts
-                qso_idx = [i[0] for i in enumerate(log) if i[1]['ts'] == qso['ts']]
-                if qso_idx:
-                    log[qso_idx[0]] = qso
-                else:
-                    log.append(qso)
-                db_update = await DB.execute("""
-                    update log set qso = %(qso)s
-                    where callsign = %(callsign)s and (qso->>'ts')::float = %(ts)s
-                    returning (qso->>'ts')::float""",
-                    {'callsign': callsign, 'ts': qso['ts'], 'qso': json.dumps(qso)})
-                if not db_update:
-                    prev_ts = await db_insert_qso(callsign, qso)
-                    if prev_ts:
-                        qso['ts'] = prev_ts
-
-            else:
-                new_qso = True
-                if log:
-                    for log_qso in log:
-                        same_fl = True
-                        for key in qso:
-                            if key not in ('ts', 'rda', 'wff', 'comments',
-                                'serverTs', 'qso_ts', 'qth', 'no', 'sound') and (
-                                        key not in log_qso or qso[key] != log_qso[key]):
-                                same_fl = False
-                                break
-                        if same_fl:
-                            logging.debug('prev qso found:')
-                            new_qso = False
-                            qso['ts'] =  log_qso['ts']
-                            log_qso['qso_ts'] = qso['qso_ts']
-
-                if new_qso:
-                    status_data = await read_station_file(callsign, 'status.json')
-                    _ts = dtime.timestamp() + tzOffset()
-                    status_update = False
-                    if ('freq' not in status_data or status_data['freq']['ts'] < _ts):
-                        status_data['freq'] = {'value': qso['freq'], 'ts': _ts}
-                        status_update = True
-                    if ('callsign' not in status_data or status_data['callsign']['ts'] < _ts):
-                        status_data['callsign'] = {'value': qso['myCS'], 'ts': _ts}
-                        status_update = True
-                    if status_update:
-                        await write_station_file(callsign, 'status.json', status_data)
-
-                    qso['ts'] = time.time()
-                    while [x for x in log if x['ts'] == qso['ts']]:
-                        qso['ts'] += 0.00000001
-                    log.insert(0, qso)
-                    prev_ts = await db_insert_qso(callsign, qso)
-                    if prev_ts:
-                        qso['ts'] = prev_ts
-
-            return {'ts': qso['ts']}
-
-        for qso in data['qso']:
-            rsp.append((await process_qso(qso)))
-
-        log = sorted(log, key=lambda qso: qso['qso_ts'] if 'qso_ts' in qso else qso['ts']/10,
-                reverse=True)
-        log = log[:CONF['web'].getint('log_page_length')]
-        logging.debug(log)
-        await write_station_file(callsign, 'log.json', log)
-
+        rsp = [{'ts': qso_ts} for qso_ts in await process_qsos(callsign, log, data['qso'])]
+        await write_log_page(callsign, log)
         return web.json_response(rsp)
 
     if 'delete' in data:
         log = [x for x in log if x['ts'] != data['delete']]
-        await DB.execute("""
-            delete from log 
-            where callsign = %(callsign)s and (qso->>'ts')::float = %(ts)s""",
+        await DB.execute_named('log_delete_qso',
             {'callsign': callsign, 'ts': data['delete']})
+        await invalidate_adif_cache(callsign, await adif_cache_path(callsign))
 
     if 'clear' in data:
         log = []
         await DB.execute(
             "delete from log where callsign = %(callsign)s",
             {'callsign': callsign})
+        await invalidate_adif_cache(callsign, await adif_cache_path(callsign))
         #clear sound recordings
         station_path = await get_station_path_by_admin_cs(callsign)
         for file in Path(station_path + "/sound").glob("*"):
@@ -234,21 +559,72 @@ async def log_handler(data, *, callsign, **_):
     await write_station_file(callsign, 'log.json', log)
     return web.Response(text = 'OK')
 
+def log_search_filters(req_data):
+    """builds log search where clause and params from the search request
+    callsign may contain * and ? wildcards; dates are YYYY-MM-DD strings (UTC)"""
+    filters = ['callsign = %(station)s']
+    params = {'station': req_data['station']}
+    if req_data.get('callsign'):
+        callsign = req_data['callsign']
+        if '*' in callsign or '?' in callsign:
+            params['callsign'] = (callsign.replace('\\', '\\\\').replace('%', '\\%')
+                .replace('_', '\\_').replace('*', '%').replace('?', '_'))
+            filters.append('cs like %(callsign)s')
+        else:
+            params['callsign'] = callsign
+            filters.append('cs = %(callsign)s')
+    for field in ('band', 'mode'):
+        if req_data.get(field):
+            params[field] = str(req_data[field])
+            filters.append(f'{field} = %({field})s')
+    try:
+        if req_data.get('dateFrom'):
+            params['dateFrom'] = (datetime.strptime(req_data['dateFrom'], '%Y-%m-%d') -
+                    datetime(1970, 1, 1)) / timedelta(seconds=1)
+            filters.append('qso_ts >= %(dateFrom)s')
+        if req_data.get('dateTo'):
+            params['dateTo'] = (datetime.strptime(req_data['dateTo'], '%Y-%m-%d') +
+                    timedelta(days=1) - datetime(1970, 1, 1)) / timedelta(seconds=1)
+            filters.append('qso_ts < %(dateTo)s')
+    except (ValueError, TypeError):
+        raise web.HTTPBadRequest(text='Invalid search dates')
+    return ' and '.join(filters), params
+
 @QSO_LOG_ROUTES.post('/aiohttp/logSearch')
 async def log_search_handler(request):
+    """returns a page of the station log (newest first) as a list of qsos
+    X-Next-Before header holds the before param of the next page,
+    X-Total-Count - the number of found qsos if the count param was set"""
     req_data = await request.json()
     if not req_data.get('station'):
         return web.HTTPBadRequest(text='Invalid search params')
-    result = []
-    cs_filter = "and qso->>'cs' = %(callsign)s" if req_data.get('callsign') else ''
+    where_clause, params = log_search_filters(req_data)
+    try:
+        limit = (int(req_data['limit']) if req_data.get('limit') is not None
+            else LOG_SEARCH_PAGE_LENGTH)
+        before = int(req_data['before']) if req_data.get('before') else None
+    except (ValueError, TypeError):
+        raise web.HTTPBadRequest(text='Invalid search params')
+    if limit < 1:
+        raise web.HTTPBadRequest(text='Invalid search params')
+    params['limit'] = min(limit, LOG_SEARCH_PAGE_LENGTH_MAX)
+    headers = {}
+    if req_data.get('count'):
+        count_data = await DB.execute(
+            f"""select count(*) as qso_count from log
+                where {where_clause}""", params)
+        if not count_data:
+            raise web.HTTPInternalServerError(text='Log search failed')
+        headers['X-Total-Count'] = str(count_data['qso_count'])
+    if before:
+        where_clause += ' and id < %(before)s'
+        params['before'] = before
     db_data = await DB.execute(
         f"""select id, qso from log
-            where callsign = %(station)s {cs_filter}
-            order by id desc""",
-            req_data)
-    if db_data:
-        if isinstance(db_data, dict):
-            result.append(db_data['qso'])
-        else:
-            result = [row['qso'] for row in db_data]
-    return web.json_response(result)
+            where {where_clause}
+            order by id desc
+            limit %(limit)s""",
+            params, container='list') or []
+    if len(db_data) == params['limit']:
+        headers['X-Next-Before'] = str(db_data[-1]['id'])
+    return web.json_response([row['qso'] for row in db_data], headers=headers)
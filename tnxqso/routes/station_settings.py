@@ -10,6 +10,7 @@ from aiohttp import web
 from tnxqso.services.auth import auth, extract_callsign
 from tnxqso.db import DB
 from tnxqso.services.station_dir import write_station_file, get_station_path_by_admin_cs
+from tnxqso.services.http_cache import HTTP_CACHE, http_cache
 
 STATION_SETTINGS_ROUTES = web.RouteTableDef()
 STATION_FILES = {
@@ -44,6 +45,9 @@ async def station_user_ban_post_handler(data, *, callsign, **_):
         insert into user_bans (admin_callsign, banned_callsign)
         values (%(admin)s, %(banned)s)
         """, {'admin': data['stationAdmin'], 'banned': data['banned']})
+    #banned_by is shared by all logins with the same email
+    DB.invalidate_user_data()
+    HTTP_CACHE.invalidate(f"banlist:{data['stationAdmin']}")
     return web.Response(text='OK')
 
 @STATION_SETTINGS_ROUTES.delete('/aiohttp/station/banlist')
@@ -55,9 +59,12 @@ async def station_user_ban_delete_handler(data, *, callsign, **_):
         delete from user_bans
         where admin_callsign = %(admin)s and  banned_callsign = %(banned)s
         """, {'admin': data['stationAdmin'], 'banned': data['banned']})
+    DB.invalidate_user_data()
+    HTTP_CACHE.invalidate(f"banlist:{data['stationAdmin']}")
     return web.Response(text = 'OK')
 
 @STATION_SETTINGS_ROUTES.get('/aiohttp/station/{callsign}/banlist')
+@http_cache('banlist', lambda request: [f"banlist:{extract_callsign(request)}"])
 async def station_user_ban_list_handler(request):
     admin_callsign = extract_callsign(request)
     rsp_data = (await DB.execute("""
@@ -73,8 +80,7 @@ async def station_user_ban_list_handler(request):
 async def station_file_post_handler(data, *, callsign, **_):
     for key in data:
         if key in STATION_FILES:
-            await write_station_file(callsign, STATION_FILES[key]['file_name'], data[key],
-                    binary=STATION_FILES[key].get('binary'))
+            await write_station_file(callsign, STATION_FILES[key]['file_name'], data[key])
     return web.Response(text = 'OK')
 
 @STATION_SETTINGS_ROUTES.post('/aiohttp/station/track')
@@ -8,16 +8,17 @@ from tnxqso.services.station_dir import strip_callsign
 
 VISITORS_ROUTES = web.RouteTableDef()
 
+DB.register_query('visitors_upsert', """
+    insert into visitors (station, visitor, tab)
+    values (%(station)s, %(visitor)s, %(tab)s)
+    on CONFlict on constraint visitors_pkey do
+        update set visited = now()""")
+
 @VISITORS_ROUTES.post('/aiohttp/visitors')
 @auth(require_token=False)
 async def visitors_handler(data, *, callsign, **_):
     visitor = callsign or data.get('user_id')
-    await DB.execute("""
-        insert into visitors (station, visitor, tab)
-        values (%(station)s, %(visitor)s, %(tab)s)
-        on CONFlict on constraint visitors_pkey do
-            update set visited = now();
-        """,
+    await DB.execute_named('visitors_upsert',
         {'station': data['station'],
             'visitor': visitor,
             'tab': data['tab']})
@@ -27,10 +28,7 @@ async def visitors_handler(data, *, callsign, **_):
 @auth()
 async def visitors_stats_handler(data, *, callsign, **_):
     if callsign not in SITE_ADMINS:
-        user_station_callsign = (await DB.execute("""
-        select settings from users
-        where callsign = %(callsign)s""",
-        {'callsign': callsign}))['settings']['station']['callsign']
+        user_station_callsign = await DB.get_station_callsign(callsign)
         if strip_callsign(user_station_callsign) != data['station']:
             raise web.HTTPForbidden()
     result = {'day': {}, 'week': {}, 'total': {}}
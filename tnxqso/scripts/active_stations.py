@@ -3,14 +3,13 @@
 import logging
 import logging.handlers
 from datetime import datetime
-import json
 import time
 import asyncio
 
 import aiormq
 import aio_pika
 
-from tnxqso.common import WEB_ROOT, loadJSON, startLogging
+from tnxqso.common import WEB_ROOT, loadJSON, saveJSON, startLogging
 from tnxqso.services.station_dir import get_station_path
 from tnxqso.services.rabbitmq import create_connection, rabbitmq_publish
 
@@ -73,7 +72,6 @@ def main():
                 logging.exception("Error processing station %s", callsign)
 
     data.sort(key=lambda item: item['callsign'])
-    with open(f'{WEB_ROOT}/js/activeStations.json', 'w') as f_stations:
-        json.dump(data, f_stations, ensure_ascii = False)
+    saveJSON(f'{WEB_ROOT}/js/activeStations.json', data)
 
     asyncio.run(rabbitmq_post(data))
@@ -4,12 +4,11 @@ import pathlib
 import asyncio
 import shutil
 import os
-import json
 import logging
 
-from tnxqso.common import CONF, WEB_ROOT, loadJSON, startLogging
+from tnxqso.common import CONF, WEB_ROOT, loadJSON, saveJSON, startLogging
 from tnxqso.db import DB
-from tnxqso.services.station_dir import get_gallery_size, delete_blog_entry
+from tnxqso.services.station_dir import get_station_path_by_admin_cs, delete_blog_entry
 
 async def _main():
 
@@ -40,7 +39,7 @@ async def _main():
         if os.path.isdir(gallery_path):
             #delete station media files with no db entries
             db_media = await DB.execute("""
-                select id, "file", file_thumb
+                select id, "file", file_thumb, variants
                 from blog_entries 
                 where "user" = %(admin)s and "file" is not null
                 order by id""", settings, container='list')
@@ -49,24 +48,36 @@ async def _main():
                 for entry in db_media:
                     db_files.add(entry['file'])
                     db_files.add(entry['file_thumb'])
+                    db_files.update(variant['file'] for variant in entry['variants'] or [])
             for file_path in [x 
                     for x in pathlib.Path(gallery_path).iterdir()
-                    if x.is_file()]:
+                    if x.is_file() and not x.name.startswith('.')]:
                 if f"gallery/{file_path.name}" not in db_files:
                     os.unlink(file_path)
 
-
-            #check gallery size and delete older media if out of quota
-            if db_media:
-                gallery_size = get_gallery_size(station_path)
-                user_quota = int(CONF['gallery']['quota']*db_settings['gallery_quotas'])
-                if gallery_size > user_quota:
-                    for entry in db_media:
-                        file_size = os.path.getsize(f"{station_path}/{entry['file']}")
-                        await delete_blog_entry(entry, station_path)
-                        gallery_size -= file_size
-                        if gallery_size <= user_quota:
-                            break
+    #delete older media of users out of quota
+    over_quota = await DB.execute("""
+        select callsign, gallery_used, gallery_quotas * %(quota)s as quota
+        from users
+        where gallery_used > gallery_quotas * %(quota)s""",
+        {'quota': int(CONF['gallery']['quota'])}, container='list')
+    for user in over_quota or []:
+        try:
+            station_path = await get_station_path_by_admin_cs(user['callsign'])
+        except Exception:
+            logging.exception('Error processing user %s gallery', user['callsign'])
+            continue
+        db_media = await DB.execute("""
+            select id, "file", file_thumb, variants, file_size
+            from blog_entries 
+            where "user" = %(callsign)s and "file" is not null
+            order by id""", user, container='list')
+        gallery_size = user['gallery_used']
+        for entry in db_media or []:
+            await delete_blog_entry(entry, station_path)
+            gallery_size -= entry['file_size']
+            if gallery_size <= user['quota']:
+                break
 
     await DB.disconnect()
 
@@ -75,8 +86,7 @@ async def _main():
     publish = {callsign: publish[callsign] for callsign in publish
             if os.path.exists(f"{WEB_ROOT}/stations/{callsign.lower().replace('/', '-')}")}
 
-    with open(publish_path, 'w') as f_publish:
-        json.dump(publish, f_publish, ensure_ascii = False)
+    saveJSON(publish_path, publish)
 
 def main():
     asyncio.run(_main())
@@ -1,11 +1,10 @@
 #!/usr/bin/python3
 #coding=utf-8
-import json
 import pathlib
 import re
 import argparse
 
-from tnxqso.common import CONF, WEB_ROOT, loadJSON, startLogging
+from tnxqso.common import CONF, WEB_ROOT, loadJSON, saveJSON, startLogging
 from tnxqso.lib import cluster_consumer
 
 
@@ -61,5 +60,4 @@ def main():
             if idx > 0:
                 if len( stationDX ) > 20:
                     stationDX = stationDX[:20]
-                with open( stationDXpath, 'w' ) as f:
-                    json.dump( stationDX, f, ensure_ascii = False )
+                saveJSON(stationDXpath, stationDX)
@@ -0,0 +1,36 @@
+#!/usr/bin/python3
+#coding=utf-8
+import asyncio
+import os
+
+from tnxqso.db import DB
+from tnxqso.services.station_dir import get_station_path_by_admin_cs
+
+async def _main():
+
+    await DB.connect()
+
+    entries = await DB.execute("""
+        select id, "user", "file"
+        from blog_entries
+        where "file" is not null and file_size = 0""", container="list")
+    station_paths = {}
+    for entry in entries or []:
+        if entry['user'] not in station_paths:
+            try:
+                station_paths[entry['user']] = await get_station_path_by_admin_cs(entry['user'])
+            except Exception:
+                station_paths[entry['user']] = None
+        station_path = station_paths[entry['user']]
+        file_path = f"{station_path}/{entry['file']}"
+        if station_path and os.path.isfile(file_path):
+            await DB.execute("""
+                update blog_entries
+                set file_size = %(file_size)s
+                where id = %(id)s""",
+                {'id': entry['id'], 'file_size': os.path.getsize(file_path)})
+
+    await DB.disconnect()
+
+if __name__ == '__main__':
+    asyncio.run(_main())
@@ -4,6 +4,8 @@ import time
 import base64
 import os
 import logging
+import shutil
+import tempfile
 from functools import wraps
 
 import jwt
@@ -12,11 +14,18 @@ from aiohttp import web
 
 from tnxqso.common import CONF, loadJSON, WEB_ROOT
 from tnxqso.db import DB
+from tnxqso.services.station_dir import get_station_path_by_admin_cs, get_user_gallery_usage
+from tnxqso.services.file_io import FILE_IO
+from tnxqso.services.http_client import HTTP_CLIENT
 
 SITE_ADMINS = frozenset(CONF.get('web', 'admins').split(' '))
 
 BANLIST = loadJSON(WEB_ROOT + '/js/banlist.json') or {'callsigns': [], 'emails': []}
 
+UPLOAD_MAX_SIZE = CONF.getint('web', 'client_max_size', fallback=200 * 1024 ** 2)
+UPLOAD_DIR = CONF.get('files', 'upload_tmp', fallback=tempfile.gettempdir())
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
 SECRET = None
 fp_secret = CONF.get('files', 'secret')
 if os.path.isfile(fp_secret):
@@ -30,10 +39,10 @@ if not SECRET:
 async def check_recaptcha(response):
     try:
         rc_data = {'secret': CONF.get('recaptcha', 'secret'), 'response': response}
-        async with aiohttp.ClientSession() as session:
-            resp = await session.post(CONF.get('recaptcha', 'verifyURL'), data = rc_data)
-            resp_data = await resp.json()
-            return resp_data['success']
+        #recaptcha tokens are single use, a retried verification fails as a duplicate
+        resp = await HTTP_CLIENT.post(CONF.get('recaptcha', 'verifyURL'), data = rc_data,
+                retries = 0)
+        return resp.json()['success']
     except Exception:
         logging.exception('Recaptcha error')
         return False
@@ -105,30 +114,115 @@ async def authenticate(callsign, email=None, /, *,
     if require_admin and callsign not in SITE_ADMINS:
         raise web.HTTPUnauthorized(text="You must be logged in as site admin")
 
-async def read_multipart(request):
+class UploadedFile:
+    """file part of a multipart request saved to a temporary file,
+    the handler should move it to its place, otherwise it is deleted
+    after the request"""
+
+    def __init__(self, path, name, content_type, size):
+        self.path = path
+        self.name = name
+        self.type = content_type
+        self.size = size
+
+def uploaded_files(data):
+    return [val for val in data.values() if isinstance(val, UploadedFile)]
+
+def remove_uploaded_files(data):
+    for file in uploaded_files(data):
+        if os.path.isfile(file.path):
+            os.unlink(file.path)
+
+async def gallery_upload_target(callsign):
+    """station gallery directory and the space left in the user's quota"""
+    station_path = await get_station_path_by_admin_cs(callsign)
+    usage = await get_user_gallery_usage(callsign)
+    return f'{station_path}/gallery', usage['quota'] - usage['used']
+
+def quota_exceeded(limit, size):
+    return web.HTTPRequestEntityTooLarge(max_size=max(limit, 0), actual_size=size,
+            text='Gallery quota exceeded')
+
+async def save_upload(field, dir_path, limit, gallery_limit=None):
+    if not os.path.isdir(dir_path):
+        os.makedirs(dir_path)
+    fd, path = tempfile.mkstemp(dir=dir_path, prefix='.upload-')
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as f_upload:
+            while True:
+                chunk = await field.read_chunk(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if gallery_limit is not None and size > gallery_limit:
+                    raise quota_exceeded(gallery_limit, size)
+                if size > limit:
+                    raise web.HTTPRequestEntityTooLarge(max_size=limit, actual_size=size)
+                await FILE_IO.run(f_upload.write, chunk)
+        #mkstemp creates the file readable by the owner only
+        os.chmod(path, 0o644)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return UploadedFile(path, field.filename, field.headers.get(aiohttp.hdrs.CONTENT_TYPE),
+            size)
+
+async def read_multipart(request, *, gallery_upload=False, require_email=False):
+    """file parts are streamed to temporary files,
+    gallery uploads go to the station gallery directory with the user's quota
+    checked while the file is received (if the token precedes the file)"""
     data = {}
+    gallery = None
     reader = await request.multipart()
-    while True:
-        field = await reader.next()
-        if not field:
-            break
-        contents = await field.read()
-        if field.filename:
-            data[field.name] = {
-                'contents': contents,
-                'name': field.filename,
-                'type': field.headers[aiohttp.hdrs.CONTENT_TYPE]}
-        else:
-            data[field.name] = contents.decode('utf-8')
-            if data[field.name] == 'null':
-                data[field.name] = None
+    try:
+        while True:
+            field = await reader.next()
+            if not field:
+                break
+            if field.filename:
+                dir_path, gallery_limit = UPLOAD_DIR, None
+                if gallery_upload and data.get('token'):
+                    if not gallery:
+                        callsign, _ = decode_token(data['token'], require_email=require_email)
+                        gallery = await gallery_upload_target(callsign)
+                    dir_path, gallery_limit = gallery
+                data[field.name] = await save_upload(field, dir_path, UPLOAD_MAX_SIZE,
+                        gallery_limit)
+                if gallery:
+                    gallery = (gallery[0], gallery[1] - data[field.name].size)
+            else:
+                contents = await field.read()
+                data[field.name] = contents.decode('utf-8')
+                if data[field.name] == 'null':
+                    data[field.name] = None
+    except BaseException:
+        remove_uploaded_files(data)
+        raise
     return data
 
+async def move_uploads_to_gallery(data, callsign):
+    """files received before the token are checked against the quota and moved here"""
+    gallery_path, limit = await gallery_upload_target(callsign)
+    for file in uploaded_files(data):
+        if os.path.dirname(file.path) != gallery_path:
+            if file.size > limit:
+                raise quota_exceeded(limit, file.size)
+            if not os.path.isdir(gallery_path):
+                os.makedirs(gallery_path)
+            path = f'{gallery_path}/{os.path.basename(file.path)}'
+            await FILE_IO.run(shutil.move, file.path, path)
+            file.path = path
+        limit -= file.size
+
 
 def auth(require_token=True,
         require_email=False,
         require_admin=False,
-        require_email_confirmed=False):
+        require_email_confirmed=False,
+        gallery_upload=False):
+    """gallery_upload: multipart file parts are saved to the station gallery
+    and count against the user's gallery quota"""
 
     def auth_wrapper(handler):
 
@@ -136,19 +230,27 @@ def auth(require_token=True,
         async def auth_wrapped(request):
             data = None
             if 'multipart/form-data;' in (request.headers.get(aiohttp.hdrs.CONTENT_TYPE) or ''):
-                data = await read_multipart(request)
+                data = await read_multipart(request, gallery_upload=gallery_upload,
+                        require_email=require_email)
             else:
                 data = await request.json()
 
-            callsign = email = None
-            if data.get('token'):
-                callsign, email = decode_token(data['token'], require_email=require_email)
-                await authenticate(callsign, email, require_email_confirmed=require_email_confirmed,
-                        require_admin=require_admin)
-            elif require_token:
-                raise web.HTTPBadRequest(text='Token is missing')
+            try:
+                callsign = email = None
+                if data.get('token'):
+                    callsign, email = decode_token(data['token'], require_email=require_email)
+                    await authenticate(callsign, email,
+                            require_email_confirmed=require_email_confirmed,
+                            require_admin=require_admin)
+                elif require_token:
+                    raise web.HTTPBadRequest(text='Token is missing')
+
+                if gallery_upload and callsign and uploaded_files(data):
+                    await move_uploads_to_gallery(data, callsign)
 
-            return await handler(data, callsign=callsign, email=email, request=request)
+                return await handler(data, callsign=callsign, email=email, request=request)
+            finally:
+                remove_uploaded_files(data)
 
         return auth_wrapped
 
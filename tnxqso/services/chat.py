@@ -1,19 +1,18 @@
 #!/usr/bin/python3
 #coding=utf-8
 import time
-import json
 from datetime import datetime
 
 from aiohttp import web
 
-from tnxqso.common import CONF, loadJSON, dtFmt, WEB_ROOT
+from tnxqso.common import dtFmt, WEB_ROOT
 from tnxqso.services.station_dir import get_station_path, strip_callsign
 from tnxqso.services.auth import SITE_ADMINS
 from tnxqso.services.rabbitmq import rabbitmq_publish
+from tnxqso.services.chat_store import get_chat
+from tnxqso.services.file_writer import FILE_WRITER
 from tnxqso.db import DB
 
-CHAT_MAX_LENGTH = int(CONF['chat']['max_length'])
-
 async def insert_chat_message(data, callsign, request, force_admin=False):
     station = data['station'] if 'station' in data else None
     if station:
@@ -22,7 +21,7 @@ async def insert_chat_message(data, callsign, request, force_admin=False):
         if force_admin:
             admin = True
         else:
-            station_settings = loadJSON(station_path + '/settings.json')
+            station_settings = await FILE_WRITER.load_json(station_path + '/settings.json')
             admins = [x.lower() for x in\
                 station_settings['chatAdmins'] + [ station_settings['admin'], ]]
             admin = callsign in admins
@@ -39,7 +38,6 @@ async def insert_chat_message(data, callsign, request, force_admin=False):
         admin = callsign in SITE_ADMINS
     data['cs'] = callsign
 
-    chat = loadJSON(chat_path) or []
     msg = {'user': data['from'],
             'text': data['text'],
             'cs': data.get('cs') or data['from'],
@@ -48,17 +46,9 @@ async def insert_chat_message(data, callsign, request, force_admin=False):
     msg['date'], msg['time'] = dtFmt(datetime.utcnow())
     if 'name' in data:
         msg['name'] = data['name']
-    chat.insert(0, msg)
-    chat_trunc = []
-    chat_adm = []
-    for _msg in chat:
-        if _msg['text'].startswith('***') and _msg['admin']:
-            chat_adm.append(_msg)
-        elif len(chat_trunc) < CHAT_MAX_LENGTH:
-            chat_trunc.append(_msg)
-    chat = chat_adm + chat_trunc
-    with open(chat_path, 'w') as f_chat:
-        json.dump(chat, f_chat, ensure_ascii = False)
+    chat = await get_chat(chat_path)
+    async with chat.lock:
+        chat.add(msg)
     if request.app.get('rabbitmq') and request.app['rabbitmq']['exchanges'].get('chats'):
         await rabbitmq_publish(request.app['rabbitmq']['exchanges']['chats'],
                 key=strip_callsign(station) if station else 'talks',
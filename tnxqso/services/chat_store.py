@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+#coding=utf-8
+import asyncio
+import json
+from collections import deque
+
+from tnxqso.common import CONF
+from tnxqso.services.file_writer import FILE_WRITER
+
+CHAT_MAX_LENGTH = int(CONF['chat']['max_length'])
+CHAT_FLUSH_DELAY = CONF.getfloat('chat', 'flush_delay', fallback=1)
+
+def is_pinned(msg):
+    return msg['admin'] and msg['text'].startswith('***')
+
+class Chat:
+    """in-memory chat (pinned admin messages and a ring buffer of the latest messages,
+    both newest first) which is flushed to the chat json file after changes"""
+
+    def __init__(self, path, data):
+        self.path = path
+        self.pinned = [msg for msg in data if is_pinned(msg)]
+        self.messages = deque((msg for msg in data if not is_pinned(msg)),
+                maxlen=CHAT_MAX_LENGTH)
+        self.lock = asyncio.Lock()
+        self.flush_task = None
+
+    def items(self):
+        return self.pinned + list(self.messages)
+
+    def find(self, msg_ts):
+        for msg in self.items():
+            if msg['ts'] == msg_ts:
+                return msg
+        return None
+
+    def add(self, msg):
+        if is_pinned(msg):
+            self.pinned.insert(0, msg)
+        else:
+            self.messages.appendleft(msg)
+        self.schedule_flush()
+
+    def delete(self, msg_ts):
+        self.pinned = [msg for msg in self.pinned if msg['ts'] != msg_ts]
+        self.messages = deque((msg for msg in self.messages if msg['ts'] != msg_ts),
+                maxlen=CHAT_MAX_LENGTH)
+        self.schedule_flush()
+
+    def clear(self, keep_pinned=False):
+        if not keep_pinned:
+            self.pinned = []
+        self.messages.clear()
+        self.schedule_flush()
+
+    def schedule_flush(self):
+        """changes made before the delayed flush starts are written at once"""
+        if not self.flush_task:
+            self.flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(CHAT_FLUSH_DELAY)
+        self.flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        async with self.lock:
+            FILE_WRITER.write(self.path, json.dumps(self.items(), ensure_ascii=False))
+
+CHATS = {}
+
+async def get_chat(path):
+    if path not in CHATS:
+        data = (await FILE_WRITER.load_json(path)) or []
+        if path not in CHATS:
+            CHATS[path] = Chat(path, data)
+    return CHATS[path]
+
+async def drop_chat(path):
+    """writes pending changes and forgets the chat (before the file is moved or deleted)"""
+    chat = CHATS.pop(path, None)
+    if chat:
+        if chat.flush_task:
+            chat.flush_task.cancel()
+            chat.flush_task = None
+        await chat.flush()
+        await FILE_WRITER.flush()
+
+async def flush_chats():
+    for path in list(CHATS):
+        chat = CHATS.pop(path)
+        if chat.flush_task:
+            chat.flush_task.cancel()
+            chat.flush_task = None
+            await chat.flush()
@@ -1,7 +1,16 @@
 ##!/usr/bin/python3
 #coding=utf-8
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import reverse_geocoder as rg
 
+from tnxqso.common import CONF
+from tnxqso.db import Histogram
+from tnxqso.services.spatial_cache import SpatialCache
+
 CORRECT_COUNTRIES = {
     'UA': {
         'admin1': ('Crimea', 'Misto Sevastopol\''),
@@ -9,13 +18,76 @@ CORRECT_COUNTRIES = {
         }
     }
 
-def get_country(location):
-    data = rg.search(location)
-    country = None
-    if data:
-        data = data[0]
-        country = data['cc']
-        if country in CORRECT_COUNTRIES and data['admin1'] in\
-            CORRECT_COUNTRIES[country]['admin1']:
-            country = CORRECT_COUNTRIES[country]['value']
+def correct_country(data):
+    country = data['cc']
+    if country in CORRECT_COUNTRIES and data['admin1'] in\
+        CORRECT_COUNTRIES[country]['admin1']:
+        country = CORRECT_COUNTRIES[country]['value']
     return country
+
+class CountryResolver:
+    """reverse geocoder lookups off the event loop, results are cached
+    by the location rounded to precision decimal places"""
+
+    def __init__(self, precision, cache_size):
+        self.precision = precision
+        self.cache = SpatialCache(365*24*3600, cache_size)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='countries')
+        self.geocoder = None
+        self.lock = None
+        self.batches = 0
+        self.duration = Histogram()
+
+    async def start(self):
+        """loads the geocoder dataset, lookups load it on the first call otherwise"""
+        if not self.lock:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            if not self.geocoder:
+                started = time.perf_counter()
+                self.geocoder = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, lambda: rg.RGeocoder(mode=1, verbose=False))
+                logging.info('reverse geocoder loaded in %.1f s', time.perf_counter() - started)
+
+    def stop(self):
+        self.executor.shutdown(wait=False)
+
+    def cache_key(self, location):
+        return (f"{round(float(location[0]), self.precision)}:" +
+            f"{round(float(location[1]), self.precision)}")
+
+    async def get_countries(self, locations):
+        """countries of the locations ([lat, lng]) in one geocoder query"""
+        keys = [self.cache_key(location) for location in locations]
+        result = [self.cache.get(key) for key in keys]
+        missing = {}
+        for idx, key in enumerate(keys):
+            if result[idx] is None:
+                missing.setdefault(key, []).append(idx)
+        if missing:
+            if not self.geocoder:
+                await self.start()
+            started = time.perf_counter()
+            data = await asyncio.get_running_loop().run_in_executor(self.executor,
+                self.geocoder.query,
+                [tuple(float(coord) for coord in key.split(':')) for key in missing])
+            self.duration.add(time.perf_counter() - started)
+            self.batches += 1
+            for (key, idxs), entry in zip(missing.items(), data):
+                country = correct_country(entry)
+                self.cache.put(key, country)
+                for idx in idxs:
+                    result[idx] = country
+        return result
+
+    def stats(self):
+        return dict(self.cache.stats(),
+            loaded=self.geocoder is not None,
+            batches=self.batches,
+            duration=self.duration.as_dict())
+
+COUNTRIES = CountryResolver(CONF.getint('countries', 'precision', fallback=3),
+        CONF.getint('countries', 'cache_size', fallback=100000))
+
+async def get_country(location):
+    return (await COUNTRIES.get_countries([location]))[0]
@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+#coding=utf-8
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from tnxqso.common import CONF, loadJSON, saveJSON, write_file_atomic
+from tnxqso.db import Histogram
+
+class FileIO:
+    """runs blocking file operations in a thread pool
+    no more than max_pending operations are submitted to the pool at once,
+    the rest wait on the event loop"""
+
+    def __init__(self, workers, max_pending):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.executor = None
+        self.slots = None
+        self.waiting = 0
+        self.pending = 0
+        self.max_depth = 0
+        self.completed = 0
+        self.errors = 0
+        self.wait = Histogram()
+        self.duration = Histogram()
+
+    async def run(self, func, *args):
+        if not self.executor:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers,
+                    thread_name_prefix='file_io')
+            self.slots = asyncio.Semaphore(self.max_pending)
+        started = time.perf_counter()
+        self.waiting += 1
+        self.max_depth = max(self.max_depth, self.waiting + self.pending)
+        try:
+            await self.slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.pending += 1
+        submitted = time.perf_counter()
+        self.wait.add(submitted - started)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.pending -= 1
+            self.completed += 1
+            self.duration.add(time.perf_counter() - submitted)
+            self.slots.release()
+
+    def shutdown(self):
+        if self.executor:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'max_pending': self.max_pending,
+            'waiting': self.waiting,
+            'pending': self.pending,
+            'max_depth': self.max_depth,
+            'completed': self.completed,
+            'errors': self.errors,
+            'wait': self.wait.as_dict(),
+            'duration': self.duration.as_dict()
+            }
+
+FILE_IO = FileIO(CONF.getint('files', 'io_workers', fallback=4),
+        CONF.getint('files', 'io_max_pending', fallback=64))
+
+async def load_json(path):
+    return await FILE_IO.run(loadJSON, path)
+
+async def save_json(path, data):
+    await FILE_IO.run(saveJSON, path, data)
+
+async def write_file(path, contents):
+    await FILE_IO.run(write_file_atomic, path, contents)
+
+class LoopLagMonitor:
+    """sleeps for interval seconds and logs when the loop wakes it up
+    more than threshold seconds late (the loop was blocked)"""
+
+    def __init__(self, interval, threshold):
+        self.interval = interval
+        self.threshold = threshold
+        self.task = None
+        self.lag = Histogram()
+        self.blocked = 0
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = loop.time() - started - self.interval
+            self.lag.add(lag)
+            if lag > self.threshold:
+                self.blocked += 1
+                logging.warning('Event loop was blocked for %.3f s', lag)
+
+    def start(self):
+        if not self.task:
+            self.task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    def stats(self):
+        return {'blocked': self.blocked, 'lag': self.lag.as_dict()}
+
+LOOP_LAG_MONITOR = LoopLagMonitor(CONF.getfloat('web', 'loop_lag_interval', fallback=0.5),
+        CONF.getfloat('web', 'loop_lag_threshold', fallback=0.1))
@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+#coding=utf-8
+import asyncio
+import json
+import logging
+
+from tnxqso.common import CONF, write_file_atomic
+from tnxqso.services.file_io import FILE_IO, load_json
+
+class FileWriter:
+    """keeps the latest contents of each file written since the last flush
+    and writes them from a background task every interval seconds
+    until start() is called (and after stop()) files are written immediately"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.pending = {}
+        self.flushing = {}
+        self.lock = None
+        self.task = None
+        self.writes = 0
+        self.coalesced = 0
+
+    def write(self, path, contents):
+        if not self.task:
+            self._write(path, contents)
+            return
+        if path in self.pending:
+            self.coalesced += 1
+        self.pending[path] = contents
+
+    def read(self, path):
+        """contents of the file which are not written yet or None"""
+        if path in self.pending:
+            return self.pending[path]
+        return self.flushing.get(path)
+
+    async def load_json(self, path):
+        contents = self.read(path)
+        if contents is None:
+            return await load_json(path)
+        return json.loads(contents)
+
+    def _write(self, path, contents):
+        try:
+            write_file_atomic(path, contents)
+            self.writes += 1
+        except OSError:
+            logging.exception('Error writing file %s', path)
+
+    async def flush(self):
+        """flushes are serialized so a file is never written by two flushes at once
+        and the contents being written stay readable until they reach the disk"""
+        if not self.lock:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            if not self.pending:
+                return
+            self.flushing, self.pending = self.pending, {}
+            try:
+                for path, contents in self.flushing.items():
+                    await FILE_IO.run(self._write, path, contents)
+            finally:
+                self.flushing = {}
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                logging.exception('Error flushing files')
+
+    def start(self):
+        if not self.task:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        await self.flush()
+
+    def stats(self):
+        return {
+            'pending': len(self.pending),
+            'writes': self.writes,
+            'coalesced': self.coalesced
+            }
+
+FILE_WRITER = FileWriter(CONF.getfloat('files', 'flush_interval', fallback=1))
@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+#coding=utf-8
+import logging
+import os
+import time
+
+from tnxqso.common import CONF
+from tnxqso.db import Histogram
+from tnxqso.lib.geo_index import load_geojson_layer
+from tnxqso.services.file_io import FILE_IO
+
+class GeoLayers:
+    """polygon layers exported from the wfs as {layer_dir}/{wfs_type}.geojson
+    indexed in memory for offline lookups, layers without a file are not loaded
+    and their lookups are resolved by the wfs"""
+
+    def __init__(self, layer_dir, distance):
+        self.layer_dir = layer_dir
+        self.distance = distance
+        self.layers = {}
+        self.hits = 0
+        self.misses = 0
+        self.duration = Histogram()
+
+    async def start(self, layer_tags):
+        """layer_tags: {wfs_type: feature property holding the value}"""
+        if not self.layer_dir:
+            return
+        for wfs_type, tag in layer_tags.items():
+            path = os.path.join(self.layer_dir, wfs_type + '.geojson')
+            if not os.path.isfile(path):
+                continue
+            try:
+                started = time.perf_counter()
+                self.layers[wfs_type] = await FILE_IO.run(load_geojson_layer, path, tag)
+                logging.info('geo layer %s loaded: %d features in %.1f s', wfs_type,
+                    len(self.layers[wfs_type].values), time.perf_counter() - started)
+            except Exception:
+                logging.exception('Error loading geo layer %s', path)
+
+    def lookup(self, wfs_type, location, strict=False):
+        """values of the layer features at the location [lat, lng]
+        (or within self.distance meters of it if not strict),
+        None if the layer is not loaded or nothing is found"""
+        layer = self.layers.get(wfs_type)
+        if not layer:
+            return None
+        started = time.perf_counter()
+        result = layer.lookup(float(location[0]), float(location[1]),
+                0 if strict else self.distance)
+        self.duration.add(time.perf_counter() - started)
+        if result:
+            self.hits += 1
+            return result
+        self.misses += 1
+        return None
+
+    def stats(self):
+        return {
+            'layers': {wfs_type: len(layer.values) for wfs_type, layer in self.layers.items()},
+            'hits': self.hits,
+            'misses': self.misses,
+            'duration': self.duration.as_dict()
+            }
+
+GEO_LAYERS = GeoLayers(CONF.get('geo_layers', 'dir', fallback=None),
+        CONF.getfloat('geo_layers', 'distance', fallback=250))
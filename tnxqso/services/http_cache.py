@@ -0,0 +1,132 @@
+#!/usr/bin/python3
+#coding=utf-8
+import hashlib
+import time
+from collections import OrderedDict, defaultdict
+from functools import wraps
+
+from aiohttp import web
+
+from tnxqso.common import CONF
+
+class CachedResponse:
+
+    def __init__(self, response, tags, ttl):
+        self.body = response.body
+        self.status = response.status
+        self.content_type = response.content_type
+        self.charset = response.charset
+        self.headers = {key: val for key, val in response.headers.items()
+                if key not in ('Content-Length', 'Content-Type')}
+        self.last_modified = response.last_modified
+        self.etag = hashlib.blake2b(self.body, digest_size=16).hexdigest()
+        self.tags = tags
+        self.expires = time.monotonic() + ttl
+
+class HTTPCache:
+    """in-process cache of public GET responses
+    entries are keyed by path and query and expire after ttl seconds,
+    write handlers invalidate them by tags (e.g. 'blog:<callsign>')"""
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.tag_keys = defaultdict(set)
+        self.version = 0
+        self.invalidated = {}
+        self.counters = defaultdict(lambda: {'hits': 0, 'misses': 0, 'not_modified': 0})
+        self.invalidations = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry and entry.expires < time.monotonic():
+            self._drop(key)
+            entry = None
+        if entry:
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, response, tags, version):
+        """stores the response unless its tags were invalidated after version"""
+        if any(self.invalidated.get(tag, 0) > version for tag in tags):
+            return None
+        if key in self.entries:
+            self._drop(key)
+        entry = CachedResponse(response, tags, self.ttl)
+        self.entries[key] = entry
+        for tag in tags:
+            self.tag_keys[tag].add(key)
+        while len(self.entries) > self.max_entries:
+            self._drop(next(iter(self.entries)))
+        return entry
+
+    def _drop(self, key):
+        entry = self.entries.pop(key)
+        for tag in entry.tags:
+            self.tag_keys[tag].discard(key)
+            if not self.tag_keys[tag]:
+                del self.tag_keys[tag]
+
+    def invalidate(self, *tags):
+        self.version += 1
+        for tag in tags:
+            self.invalidated[tag] = self.version
+            for key in list(self.tag_keys.get(tag, ())):
+                self._drop(key)
+        self.invalidations += 1
+        if len(self.invalidated) > self.max_entries:
+            #entries older than the last requests in flight are of no use
+            self.invalidated = {tag: version for tag, version in self.invalidated.items()
+                    if version > self.version - self.max_entries}
+
+    def count(self, name, counter):
+        self.counters[name][counter] += 1
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'invalidations': self.invalidations,
+            'routes': dict(self.counters)
+            }
+
+HTTP_CACHE = HTTPCache(CONF.getfloat('web', 'http_cache_ttl', fallback=60),
+        CONF.getint('web', 'http_cache_size', fallback=1000))
+
+def not_modified(request, entry):
+    if f'"{entry.etag}"' in request.headers.get('If-None-Match', ''):
+        return True
+    return bool(entry.last_modified and request.if_modified_since and
+            entry.last_modified <= request.if_modified_since)
+
+def http_cache(name, tags):
+    """caches successful responses of a GET handler
+    tags: function of the request returning the invalidation tags of the response"""
+
+    def cache_wrapper(handler):
+
+        @wraps(handler)
+        async def cache_wrapped(request):
+            key = request.path_qs
+            entry = HTTP_CACHE.get(key)
+            if entry:
+                HTTP_CACHE.count(name, 'hits')
+            else:
+                HTTP_CACHE.count(name, 'misses')
+                version = HTTP_CACHE.version
+                response = await handler(request)
+                if response.status != 200 or not isinstance(response.body, bytes):
+                    return response
+                entry = HTTP_CACHE.put(key, response, tags(request), version)
+                if not entry:
+                    return response
+            if not_modified(request, entry):
+                HTTP_CACHE.count(name, 'not_modified')
+                raise web.HTTPNotModified(headers={'ETag': f'"{entry.etag}"'})
+            return web.Response(body=entry.body, status=entry.status,
+                    content_type=entry.content_type, charset=entry.charset,
+                    headers={**entry.headers, 'ETag': f'"{entry.etag}"'})
+
+        return cache_wrapped
+
+    return cache_wrapper
@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+#coding=utf-8
+import asyncio
+import logging
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+import httpx
+
+from tnxqso.common import CONF
+
+IDEMPOTENT_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'))
+#errors raised before the request reaches the server
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+class HTTPClient:
+    """app-lifetime outbound http client (keep-alive connection pool)
+    requests to a host are limited to per_host_limit at once,
+    failed connects and timeouts are retried while retries stay
+    within retry_budget share of all requests;
+    requests with non-idempotent methods are retried only if they were not sent"""
+
+    def __init__(self, *, timeout, connect_timeout, max_connections, per_host_limit,
+            retries, retry_budget):
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=max_connections,
+                max_keepalive_connections=max_connections)
+        self.per_host_limit = per_host_limit
+        self.retries = retries
+        self.retry_budget = retry_budget
+        self.client = None
+        self.host_slots = defaultdict(lambda: asyncio.Semaphore(self.per_host_limit))
+        self.requests = 0
+        self.retried = 0
+        self.errors = 0
+
+    def start(self):
+        if not self.client:
+            self.client = httpx.AsyncClient(timeout=self.timeout, limits=self.limits)
+
+    async def stop(self):
+        if self.client:
+            await self.client.aclose()
+            self.client = None
+
+    def can_retry(self):
+        return self.retried < self.retry_budget * self.requests
+
+    async def request(self, method, url, retries=None, **kwargs):
+        """retries - max retries of this request (self.retries by default)"""
+        self.start()
+        self.requests += 1
+        retries = self.retries if retries is None else retries
+        retry_errors = ((httpx.ConnectError, httpx.TimeoutException)
+            if method.upper() in IDEMPOTENT_METHODS else NOT_SENT_ERRORS)
+        attempt = 0
+        async with self.host_slots[urlsplit(url).netloc]:
+            while True:
+                try:
+                    return await self.client.request(method, url, **kwargs)
+                except retry_errors:
+                    if attempt < retries and self.can_retry():
+                        attempt += 1
+                        self.retried += 1
+                        logging.warning('Retrying %s %s', method, url)
+                        continue
+                    self.errors += 1
+                    raise
+                except httpx.HTTPError:
+                    self.errors += 1
+                    raise
+
+    async def get(self, url, **kwargs):
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request('POST', url, **kwargs)
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'retried': self.retried,
+            'errors': self.errors
+            }
+
+HTTP_CLIENT = HTTPClient(
+        timeout=CONF.getfloat('http_client', 'timeout', fallback=5),
+        connect_timeout=CONF.getfloat('http_client', 'connect_timeout', fallback=2),
+        max_connections=CONF.getint('http_client', 'max_connections', fallback=50),
+        per_host_limit=CONF.getint('http_client', 'per_host_limit', fallback=10),
+        retries=CONF.getint('http_client', 'retries', fallback=1),
+        retry_budget=CONF.getfloat('http_client', 'retry_budget', fallback=0.1))
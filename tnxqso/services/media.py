@@ -0,0 +1,218 @@
+#!/usr/bin/python3
+#coding=utf-8
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from ctypes import c_void_p, c_size_t
+
+import ffmpeg
+from wand.image import Image
+from wand.color import Color
+from wand.api import library
+
+from tnxqso.common import CONF
+from tnxqso.db import DB
+from tnxqso.services.station_dir import get_station_path_by_admin_cs, delete_blog_entry
+from tnxqso.services.http_cache import HTTP_CACHE
+
+library.MagickSetCompressionQuality.argtypes = [c_void_p, c_size_t]
+
+VARIANT_WIDTHS = [int(width) for width in
+        CONF.get('gallery', 'variant_widths', fallback='480 960 1600').split()]
+VARIANT_FORMATS = CONF.get('gallery', 'variant_formats', fallback='webp jpeg').split()
+
+def make_variants(img, gallery_path, file_name_base):
+    """saves downscaled copies of the decoded image in every configured width
+    (narrower than the image) and format
+    returns the list of variants: file, format, width, height, size"""
+    variants = []
+    quality = int(CONF['gallery']['quality'])
+    with img.clone() as oriented:
+        oriented.auto_orient()
+        oriented.strip()
+        for width in sorted(VARIANT_WIDTHS):
+            if width >= oriented.width:
+                break
+            with oriented.clone() as variant:
+                variant.resize(width=width,
+                        height=round(oriented.height*width/oriented.width))
+                variant.compression_quality = quality
+                for fmt in VARIANT_FORMATS:
+                    file_name = f'{file_name_base}_{width}.{fmt}'
+                    try:
+                        variant.format = fmt
+                        variant.save(filename=f'{gallery_path}/{file_name}')
+                    except Exception:
+                        logging.exception('Error saving %s image variant', fmt)
+                        continue
+                    variants.append({
+                        'file': f'gallery/{file_name}',
+                        'format': fmt,
+                        'width': variant.width,
+                        'height': variant.height,
+                        'size': os.path.getsize(f'{gallery_path}/{file_name}')
+                        })
+    return variants
+
+def derived_media_files(file_name):
+    """names of all the files process_media can make from the uploaded file"""
+    file_name_base, _, file_ext = file_name.rpartition('.')
+    return ([f'{file_name_base}_thumb.jpeg', f'{file_name_base}.jpeg',
+        f'{file_name_base}_tmp.{file_ext}'] +
+        [f'{file_name_base}_{width}.{fmt}'
+            for width in VARIANT_WIDTHS for fmt in VARIANT_FORMATS])
+
+def process_media(gallery_path, file_name, file_type):
+    """makes the thumbnail and scales down the uploaded image/video
+    runs in a worker process, returns the thumbnail file name,
+    the image variants and the size of the processed files"""
+    file_name_base, _, file_ext = file_name.rpartition('.')
+    file_path = f'{gallery_path}/{file_name}'
+    tn_src = file_path
+    if file_type == 'video':
+
+        tn_src = gallery_path + '/' + file_name_base + '.jpeg'
+        (
+            ffmpeg
+                .input(file_path)
+                .output(tn_src, vframes=1, vf="thumbnail")
+                .run(overwrite_output=True)
+        )
+        video_props = ffmpeg.probe(file_path)
+        video_stream = [stream for stream in video_props['streams']
+                if stream['codec_type'] == 'video'][0]
+        max_video_height = int(CONF['gallery']['max_video_height'])
+        if video_stream['height'] > max_video_height:
+            tmp_file_path = f"{gallery_path}/{file_name_base}_tmp.{file_ext}"
+            os.rename(file_path, tmp_file_path)
+            (
+                ffmpeg
+                    .output(
+                        ffmpeg
+                            .input(tmp_file_path)
+                            .video
+                            .filter('scale', -2, max_video_height),
+                         ffmpeg
+                            .input(tmp_file_path)
+                            .audio,
+                        file_path)
+                    .run()
+            )
+            os.unlink(tmp_file_path)
+
+    file_thumb = f'{file_name_base}_thumb.jpeg'
+    variants = []
+    with Image(filename=tn_src) as img:
+        with Image(width=img.width, height=img.height,
+                background=Color("#EEEEEE")) as bg_img:
+
+            bg_img.composite(img, 0, 0)
+
+            exif = {}
+            exif.update((key[5:], val) for key, val in img.metadata.items() if
+                    key.startswith('exif:'))
+            if 'Orientation' in exif:
+                if exif['Orientation'] == '3':
+                    bg_img.rotate(180)
+                elif exif['Orientation'] == '6':
+                    bg_img.rotate(90)
+                elif exif['Orientation'] == '8':
+                    bg_img.rotate(270)
+
+            size = img.width if img.width < img.height else img.height
+            bg_img.crop(width=size, height=size, gravity='north')
+            bg_img.resize(200, 200)
+            bg_img.format = 'jpeg'
+            bg_img.save(filename=f'{gallery_path}/{file_thumb}')
+            if file_type == 'image':
+                variants = make_variants(img, gallery_path, file_name_base)
+                max_height, max_width = (int(CONF['gallery']['max_height']),
+                        int(CONF['gallery']['max_width']))
+                if img.width > max_width or img.height > max_height:
+                    coeff = min(max_width/img.width, max_height/img.height)
+                    img.resize(width=int(coeff*img.width), height=int(coeff*img.height))
+                    img.compression_quality = int(CONF['gallery']['quality'])
+                    img.save(filename=file_path)
+    if file_type == 'video':
+        os.unlink(tn_src)
+
+    return (file_thumb, variants,
+        os.path.getsize(file_path) + sum(variant['size'] for variant in variants))
+
+class MediaProcessor:
+    """processes uploaded blog media in a process pool
+    blog entries are created with processing flag set and
+    are finalized (or deleted on failure) when the processing is done"""
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.executor = None
+        self.tasks = set()
+        self.completed = 0
+        self.failed = 0
+
+    def submit(self, entry):
+        """entry: id, user, file ('gallery/<file name>'), file_type"""
+        task = asyncio.create_task(self._process(entry))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _process(self, entry):
+        station_path = await get_station_path_by_admin_cs(entry['user'])
+        gallery_path, _, file_name = f"{station_path}/{entry['file']}".rpartition('/')
+        try:
+            file_thumb, variants, file_size = await asyncio.get_running_loop().run_in_executor(
+                self.executor, process_media, gallery_path, file_name, entry['file_type'])
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logging.exception('Error processing blog entry %s media', entry['id'])
+            self.failed += 1
+            #the files made before the failure are removed along with the upload
+            await delete_blog_entry({'id': entry['id'], 'file': entry['file'],
+                'file_thumb': None,
+                'variants': [{'file': f'gallery/{derived_file}'}
+                    for derived_file in derived_media_files(file_name)
+                    if derived_file != file_name]}, station_path)
+            return
+        await DB.execute("""
+            update blog_entries
+            set file_thumb = %(file_thumb)s, variants = %(variants)s,
+                file_size = %(file_size)s, processing = false
+            where id = %(id)s""",
+            {'id': entry['id'], 'file_thumb': f'gallery/{file_thumb}',
+                'variants': json.dumps(variants), 'file_size': file_size})
+        HTTP_CACHE.invalidate(f"blog:{entry['user']}")
+        self.completed += 1
+
+    async def start(self):
+        """requeues the entries left unprocessed by the previous run"""
+        # workers are spawned, forking the running server process is not safe
+        self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'))
+        entries = await DB.execute("""
+            select id, "user", "file", file_type
+            from blog_entries
+            where processing""",
+            container='list')
+        for entry in entries or []:
+            self.submit(entry)
+
+    def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def stats(self):
+        return {
+            'processing': len(self.tasks),
+            'completed': self.completed,
+            'failed': self.failed
+            }
+
+MEDIA_PROCESSOR = MediaProcessor(CONF.getint('gallery', 'workers', fallback=2))
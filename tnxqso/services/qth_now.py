@@ -0,0 +1,173 @@
+#!/usr/bin/python3
+#coding=utf-8
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from datetime import datetime
+
+from tnxqso.common import CONF, WEB_ROOT, dtFmt
+from tnxqso.db import DB
+from tnxqso.services.file_io import load_json, save_json
+
+class QthNowLocations:
+    """current locations keyed by callsign (or by location if there is no callsign),
+    a new location replaces the entries with the same callsign or the same location,
+    entries expire after expire seconds"""
+
+    def __init__(self, path, expire):
+        self.path = path
+        self.expire = expire
+        self.entries = {}
+        self.locations = {}
+        self.heap = []
+        self.counter = itertools.count()
+        self.changed = False
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry:
+            location = (entry['location'][0], entry['location'][1])
+            if self.locations.get(location) == key:
+                del self.locations[location]
+            self.changed = True
+
+    def _add(self, entry):
+        location = (entry['location'][0], entry['location'][1])
+        key = entry['callsign'] or location
+        self.entries[key] = entry
+        self.locations[location] = key
+        heapq.heappush(self.heap, (entry['ts'], next(self.counter), key))
+        self.changed = True
+
+    def update(self, callsign, location, _ts=None):
+        _ts = _ts or int(time.time())
+        if callsign:
+            self._remove(callsign)
+        self._remove(self.locations.get((location[0], location[1])))
+        _dt, _tm = dtFmt(datetime.utcfromtimestamp(_ts))
+        self._add({
+            'location': location,
+            'ts': _ts,
+            'date': _dt,
+            'time': _tm,
+            'callsign': callsign
+        })
+
+    def purge(self):
+        expired_ts = int(time.time()) - self.expire
+        while self.heap and self.heap[0][0] <= expired_ts:
+            _ts, _, key = heapq.heappop(self.heap)
+            entry = self.entries.get(key)
+            #the heap keeps the outdated items of the updated entries
+            if entry and entry['ts'] == _ts:
+                self._remove(key)
+
+    def snapshot(self):
+        self.purge()
+        return list(self.entries.values())
+
+    def query(self, min_lat, min_lng, max_lat, max_lng):
+        return [entry for entry in self.snapshot()
+            if min_lat <= entry['location'][0] <= max_lat and
+                min_lng <= entry['location'][1] <= max_lng]
+
+    async def load(self):
+        data = (await load_json(self.path)) or []
+        for entry in data:
+            self._add(entry)
+        self.purge()
+        self.changed = False
+
+    async def save(self):
+        self.purge()
+        if not self.changed:
+            return
+        self.changed = False
+        await save_json(self.path, list(self.entries.values()))
+
+def history_params(history):
+    """history rows (callsign, lat, lng, rda, ts) as the column arrays for unnest"""
+    return dict(zip(('callsigns', 'lats', 'lngs', 'rdas', 'tss'),
+        (list(column) for column in zip(*history))))
+
+class QthNow:
+    """qth now locations registry, the locations of the callsigns and all the locations
+    are exported to json files every export_interval seconds,
+    the history is written to qth_now_locations table"""
+
+    def __init__(self, expire, export_interval):
+        self.callsigns = QthNowLocations(WEB_ROOT + '/js/qth_now_locations.json', expire)
+        self.all = QthNowLocations(WEB_ROOT + '/js/qth_now_locations_all.json', expire)
+        self.export_interval = export_interval
+        self.history = []
+        self.task = None
+        self.updates = 0
+        self.exports = 0
+
+    def update(self, callsign, location):
+        """returns the ts of the update"""
+        _ts = int(time.time())
+        if callsign:
+            self.callsigns.update(callsign, location, _ts)
+        self.all.update(callsign, location, _ts)
+        self.updates += 1
+        return _ts
+
+    def add_history(self, callsign, location, rda, _ts):
+        self.history.append((callsign, location[0], location[1], rda, _ts))
+
+    def query(self, min_lat, min_lng, max_lat, max_lng, callsigns_only=False):
+        return (self.callsigns if callsigns_only else self.all).query(
+            min_lat, min_lng, max_lat, max_lng)
+
+    async def save_history(self):
+        if not self.history:
+            return
+        history, self.history = self.history, []
+        if not await DB.execute("""
+            insert into qth_now_locations (callsign, lat, lng, rda, tstamp)
+            select callsign, lat, lng, rda, to_timestamp(ts) at time zone 'UTC'
+            from unnest(%(callsigns)s::varchar[], %(lats)s::numeric[], %(lngs)s::numeric[],
+                %(rdas)s::varchar[], %(tss)s::bigint[]) as h(callsign, lat, lng, rda, ts)""",
+            history_params(history)):
+            logging.error('Error saving qth now history, %d locations are lost', len(history))
+
+    async def export(self):
+        await self.callsigns.save()
+        await self.all.save()
+        self.exports += 1
+        await self.save_history()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.export_interval)
+            try:
+                await self.export()
+            except Exception:
+                logging.exception('Error exporting qth now locations')
+
+    async def start(self):
+        if not self.task:
+            await self.callsigns.load()
+            await self.all.load()
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+            await self.export()
+
+    def stats(self):
+        return {
+            'callsigns': len(self.callsigns.entries),
+            'all': len(self.all.entries),
+            'updates': self.updates,
+            'exports': self.exports,
+            'history_pending': len(self.history)
+            }
+
+QTH_NOW = QthNow(CONF.getint('qth_now', 'expire', fallback=600),
+        CONF.getfloat('qth_now', 'export_interval', fallback=5))
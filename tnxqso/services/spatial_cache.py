@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+#coding=utf-8
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from tnxqso.common import CONF
+from tnxqso.services.file_io import load_json, save_json
+
+class SpatialCache:
+    """lru cache of lookup results by grid cell (e.g. 8 char locator)
+    entries expire after ttl seconds, the cache is saved to path (if set)
+    every save_interval seconds and on stop and loaded on start"""
+
+    def __init__(self, ttl, max_entries, path=None, save_interval=600):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.path = path
+        self.save_interval = save_interval
+        self.entries = OrderedDict()
+        self.task = None
+        self.changed = False
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry and entry[0] < time.time():
+            del self.entries[key]
+            self.expired += 1
+            entry = None
+        if not entry:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, value):
+        self.entries[key] = (time.time() + self.ttl, value)
+        self.entries.move_to_end(key)
+        self.changed = True
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evicted += 1
+
+    async def load(self):
+        data = (await load_json(self.path)) or []
+        now = time.time()
+        for key, expires, value in data:
+            if expires > now:
+                self.entries[key] = (expires, value)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def save(self):
+        if not self.changed:
+            return
+        self.changed = False
+        await save_json(self.path,
+                [[key, expires, value] for key, (expires, value) in self.entries.items()])
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.save_interval)
+            try:
+                await self.save()
+            except Exception:
+                logging.exception('Error saving spatial cache %s', self.path)
+
+    async def start(self):
+        if self.path and not self.task:
+            await self.load()
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+            await self.save()
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'expired': self.expired,
+            'evicted': self.evicted
+            }
+
+WFS_CACHE = SpatialCache(CONF.getfloat('wfs', 'cache_ttl', fallback=7*24*3600),
+        CONF.getint('wfs', 'cache_size', fallback=100000),
+        path=CONF.get('wfs', 'cache_file', fallback=None))
@@ -3,14 +3,16 @@
 
 import json
 import os
-import pathlib
 import re
 import shutil
 
 from aiohttp import web
 
-from tnxqso.common import WEB_ROOT, DEF_USER_SETTINGS, loadJSON
+from tnxqso.common import CONF, WEB_ROOT, DEF_USER_SETTINGS, saveJSON
 from tnxqso.db import DB
+from tnxqso.services.chat_store import drop_chat
+from tnxqso.services.file_writer import FILE_WRITER
+from tnxqso.services.file_io import FILE_IO, load_json, save_json
 
 JSON_TEMPLATES = {'settings': DEF_USER_SETTINGS,
     'log': [], 'chat': [], 'news': [], 'cluster': [], 'status': {} }
@@ -35,9 +37,11 @@ async def update_station_settings(callsign, settings):
     station_callsign = await DB.get_station_callsign(callsign)
     station_path = get_station_path(station_callsign) if station_callsign else None
     publish_path = WEB_ROOT + '/js/publish.json'
-    publish = loadJSON(publish_path) or {}
+    publish = (await load_json(publish_path)) or {}
     new_station_callsign = settings['station']['callsign']
     if station_callsign != new_station_callsign:
+        if station_path:
+            await drop_chat(f"{station_path}/chat.json")
         new_path = get_station_path(new_station_callsign) if new_station_callsign else None
         if new_path != station_path:
             if new_path:
@@ -55,7 +59,7 @@ async def update_station_settings(callsign, settings):
                     'delete from blog_entries where "user" = %(callsign)s',
                     {'callsign': callsign})
             if station_path and os.path.exists(station_path):
-                shutil.rmtree(station_path)
+                await FILE_IO.run(shutil.rmtree, station_path)
             await DB.execute(
                 "delete from visitors where station = %(callsign)s",
                 {'callsign': station_callsign})
@@ -69,8 +73,7 @@ async def update_station_settings(callsign, settings):
         if not station_callsign in publish:
             publish[station_callsign] = {'admin': True}
         publish[station_callsign]['user'] = settings['publish']
-    with open(publish_path, 'w') as f_publish:
-        json.dump(publish, f_publish, ensure_ascii = False)
+    await save_json(publish_path, publish)
     if station_path:
         if not os.path.exists(station_path):
             create_station_dir(station_path)
@@ -83,24 +86,22 @@ async def save_station_settings(admin_callsign, settings):
             {'settings': json.dumps(settings)})
     await write_station_file(admin_callsign, 'settings.json', settings)
 
-async def write_station_file(admin_callsign, file_name, contents, *, binary=False):
+async def write_station_file(admin_callsign, file_name, contents):
     station_path = await get_station_path_by_admin_cs(admin_callsign)
     if station_path and os.path.exists(station_path):
-        with open(f'{station_path}/{file_name}', f'w{"b" if binary else""}') as f_dest:
-            if file_name.endswith('json'):
-                contents = json.dumps(contents, ensure_ascii=False)
-            f_dest.write(contents)
+        if file_name.endswith('json'):
+            contents = json.dumps(contents, ensure_ascii=False)
+        FILE_WRITER.write(f'{station_path}/{file_name}', contents)
 
 async def read_station_file(admin_callsign, file_name):
     station_path = await get_station_path_by_admin_cs(admin_callsign)
-    return loadJSON(f"{station_path}/{file_name}")
+    return await FILE_WRITER.load_json(f"{station_path}/{file_name}")
 
 def create_station_dir(path):
     if not os.path.exists(path):
         os.makedirs(path)
     for key, val in JSON_TEMPLATES.items():
-        with open(f'{path}/{key}.json', 'w') as file:
-            json.dump(val, file, ensure_ascii = False)
+        saveJSON(f'{path}/{key}.json', val)
 
 async def delete_blog_entry(entry, station_path):
     if entry['file']:
@@ -108,14 +109,20 @@ async def delete_blog_entry(entry, station_path):
             os.unlink(f"{station_path}/{entry['file']}")
         if os.path.isfile(f"{station_path}/{entry['file_thumb']}"):
             os.unlink(f"{station_path}/{entry['file_thumb']}")
+        for variant in entry.get('variants') or []:
+            if os.path.isfile(f"{station_path}/{variant['file']}"):
+                os.unlink(f"{station_path}/{variant['file']}")
     await DB.execute("""
         delete from blog_entries
         where id = %(id)s""", entry)
 
-def get_gallery_size(station_path):
-    gallery_path = f"{station_path}/gallery"
-    if not os.path.isdir(gallery_path):
-        return 0
-    return sum(os.path.getsize(str(file_path))
-            for file_path in pathlib.Path(gallery_path).iterdir()
-            if file_path.is_file() and '_thumb' not in file_path.name)
+async def get_user_gallery_usage(callsign):
+    """gallery quota and the total size of the user's blog media files"""
+    usage = await DB.execute("""
+        select gallery_quotas, gallery_used
+        from users
+        where callsign = %(callsign)s""", {'callsign': callsign})
+    return {
+        'quota': int(CONF['gallery']['quota'])*usage['gallery_quotas'],
+        'used': usage['gallery_used']
+        }
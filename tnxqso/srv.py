@@ -14,7 +14,7 @@ from tnxqso.routes.station_settings import STATION_SETTINGS_ROUTES
 from tnxqso.routes.user import USER_ROUTES
 from tnxqso.routes.admin import ADMIN_ROUTES
 from tnxqso.routes.private_messages import PM_ROUTES
-from tnxqso.routes.location import LOCATION_ROUTES
+from tnxqso.routes.location import LOCATION_ROUTES, WFS_PARAMS
 from tnxqso.routes.blog import BLOG_ROUTES
 from tnxqso.routes.qso_log import QSO_LOG_ROUTES
 from tnxqso.routes.visitors_stats import VISITORS_ROUTES
@@ -23,11 +23,21 @@ from tnxqso.routes.chat import CHAT_ROUTES
 from tnxqso.routes.cluster import CLUSTER_ROUTES
 
 from tnxqso.services.rabbitmq import rabbitmq_connect, rabbitmq_disconnect
+from tnxqso.services.chat_store import flush_chats
+from tnxqso.services.file_writer import FILE_WRITER
+from tnxqso.services.file_io import FILE_IO, LOOP_LAG_MONITOR
+from tnxqso.services.media import MEDIA_PROCESSOR
+from tnxqso.services.auth import UPLOAD_MAX_SIZE
+from tnxqso.services.spatial_cache import WFS_CACHE
+from tnxqso.services.geo_layers import GEO_LAYERS
+from tnxqso.services.countries import COUNTRIES
+from tnxqso.services.qth_now import QTH_NOW
+from tnxqso.services.http_client import HTTP_CLIENT
 
 startLogging('srv', logging.DEBUG)
 logging.debug("server start")
 
-APP = web.Application(client_max_size = 200 * 1024 ** 2)
+APP = web.Application(client_max_size = UPLOAD_MAX_SIZE)
 APP['tnxqso-last-spot-sent'] = defaultdict(int)
 
 def run():
@@ -47,9 +57,26 @@ def run():
 
     async def on_startup(_):
         await DB.connect()
+        FILE_WRITER.start()
+        LOOP_LAG_MONITOR.start()
+        await MEDIA_PROCESSOR.start()
+        await WFS_CACHE.start()
+        await GEO_LAYERS.start({wfs_type: params['tag'] for wfs_type, params in WFS_PARAMS.items()})
+        HTTP_CLIENT.start()
+        await COUNTRIES.start()
+        await QTH_NOW.start()
         await rabbitmq_connect(APP)
 
     async def on_cleanup(_):
+        MEDIA_PROCESSOR.stop()
+        await WFS_CACHE.stop()
+        await HTTP_CLIENT.stop()
+        COUNTRIES.stop()
+        await QTH_NOW.stop()
+        await flush_chats()
+        await FILE_WRITER.stop()
+        LOOP_LAG_MONITOR.stop()
+        FILE_IO.shutdown()
         await DB.disconnect()
         await rabbitmq_disconnect(APP)
 